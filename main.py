@@ -1,12 +1,40 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
 import logging
 import os
+import pickle
 import re
+import sys
+import threading
+import time
 import requests
 import datetime
-from zoneinfo import ZoneInfo  # Add this import at the top
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from requests.adapters import HTTPAdapter
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from datetime import timedelta
-from recurring_ical_events import of  # type: ignore
-import icalendar  # type: ignore
+from dateutil.rrule import rruleset, rrulestr  # type: ignore
+
+try:
+    import numpy as np
+except ImportError:  # Optional: without NumPy dates are looked up one by one
+    np = None
+
+try:
+    import httpx
+except ImportError:  # Optional: without httpx, sync() fetches feeds on a thread
+    httpx = None
 
 # -------------------------------------------------------------------
 #
@@ -31,11 +59,183 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request URL at INFO, and feed URLs carry secret tokens
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # This is the header that will be added to and searched for in the top
 # of the calendar section in the daily note
 HEADER_CALENDAR_EVENTS = "### Calendar Events\n"
 
+# In marker mode (--markers) the calendar section is wrapped in these
+# comments, which Obsidian doesn't render, so it can be found and replaced
+# without guessing from headers
+CALENDAR_BLOCK_START = "<!-- gcal:start -->"
+CALENDAR_BLOCK_END = "<!-- gcal:end -->"
+
+# IANA timezone that events are shown in and note dates are counted in
+# (e.g. 'Europe/Berlin'); overridable per run with --timezone
+CALENDAR_TIMEZONE = os.getenv("CALENDAR_TIMEZONE", "America/New_York")
+
+# Outlook / Exchange feeds name their TZIDs after Windows zones rather
+# than IANA ones. These are the common ones (from CLDR's windowsZones);
+# any other TZID that isn't an IANA name falls back to CALENDAR_TIMEZONE
+WINDOWS_TIMEZONES = {
+    "Dateline Standard Time": "Etc/GMT+12",
+    "Hawaiian Standard Time": "Pacific/Honolulu",
+    "Alaskan Standard Time": "America/Anchorage",
+    "Pacific Standard Time": "America/Los_Angeles",
+    "US Mountain Standard Time": "America/Phoenix",
+    "Mountain Standard Time": "America/Denver",
+    "Central Standard Time": "America/Chicago",
+    "Canada Central Standard Time": "America/Regina",
+    "Central America Standard Time": "America/Guatemala",
+    "Mexico Standard Time": "America/Mexico_City",
+    "Central Standard Time (Mexico)": "America/Mexico_City",
+    "Eastern Standard Time": "America/New_York",
+    "US Eastern Standard Time": "America/Indianapolis",
+    "SA Pacific Standard Time": "America/Bogota",
+    "Atlantic Standard Time": "America/Halifax",
+    "Newfoundland Standard Time": "America/St_Johns",
+    "E. South America Standard Time": "America/Sao_Paulo",
+    "Argentina Standard Time": "America/Buenos_Aires",
+    "UTC": "Etc/UTC",
+    "GMT Standard Time": "Europe/London",
+    "Greenwich Standard Time": "Atlantic/Reykjavik",
+    "W. Europe Standard Time": "Europe/Berlin",
+    "Central Europe Standard Time": "Europe/Budapest",
+    "Central European Standard Time": "Europe/Warsaw",
+    "Romance Standard Time": "Europe/Paris",
+    "E. Europe Standard Time": "Europe/Chisinau",
+    "GTB Standard Time": "Europe/Bucharest",
+    "FLE Standard Time": "Europe/Kiev",
+    "Israel Standard Time": "Asia/Jerusalem",
+    "South Africa Standard Time": "Africa/Johannesburg",
+    "Turkey Standard Time": "Europe/Istanbul",
+    "Russian Standard Time": "Europe/Moscow",
+    "Arabian Standard Time": "Asia/Dubai",
+    "India Standard Time": "Asia/Calcutta",
+    "China Standard Time": "Asia/Shanghai",
+    "Singapore Standard Time": "Asia/Singapore",
+    "Taipei Standard Time": "Asia/Taipei",
+    "Tokyo Standard Time": "Asia/Tokyo",
+    "Korea Standard Time": "Asia/Seoul",
+    "AUS Eastern Standard Time": "Australia/Sydney",
+    "E. Australia Standard Time": "Australia/Brisbane",
+    "Cen. Australia Standard Time": "Australia/Adelaide",
+    "W. Australia Standard Time": "Australia/Perth",
+    "New Zealand Standard Time": "Pacific/Auckland",
+}
+
+# Seconds to wait for a calendar server to connect / send data before
+# giving up on that feed
+FETCH_TIMEOUT = float(os.getenv("CALENDAR_FETCH_TIMEOUT", "30"))
+
+# Downloaded feeds (body, ETag, Last-Modified) and their parsed calendars
+# are kept here between runs so unchanged feeds can be revalidated with a
+# conditional request instead of being downloaded and parsed again.
+# Keep this outside the vault so it doesn't get committed with the notes.
+CACHE_DIR = os.getenv(
+    "CALENDAR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "calendar-sync"),
+)
+
+# Records, per note, what the last sync saw (feed hashes, rendered section
+# hash, note file stat) so unchanged notes can be skipped entirely
+MANIFEST_PATH = os.getenv(
+    "CALENDAR_SYNC_MANIFEST", os.path.join(CACHE_DIR, "sync-manifest.json")
+)
+
+# Caches the dated notes found in each vault directory, validated by the
+# directory's mtime (or, after a checkout, a hash of its listing), so
+# unchanged directories are never read again
+NOTE_INDEX_PATH = os.path.join(CACHE_DIR, "note-index.json")
+
+# Note file name conventions dates can be read from, by name. Each
+# pattern captures year/month/day, or year/week for ISO week notes (which
+# get the events of their whole Monday-Sunday week). Notes are matched
+# against the formats chosen with --date-formats, in order
+NOTE_DATE_PATTERNS = {
+    "mm-dd-yyyy": re.compile(r"(?P<month>\d{2})-(?P<day>\d{2})-(?P<year>\d{4})"),
+    "yyyy-mm-dd": re.compile(r"(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})"),
+    "dd.mm.yyyy": re.compile(r"(?P<day>\d{2})\.(?P<month>\d{2})\.(?P<year>\d{4})"),
+    "yyyy-Www": re.compile(r"(?P<year>\d{4})-W(?P<week>\d{2})"),
+}
+
+# Comma-separated NOTE_DATE_PATTERNS names; overridable with --date-formats
+NOTE_DATE_FORMATS = os.getenv("CALENDAR_NOTE_DATE_FORMATS", "mm-dd-yyyy")
+
+# Vault directories (by name, at any depth) that are never synced
+SKIP_DIRS = {"Archive", "Weekly"}
+
+# Directories modified this recently aren't cached in the note index: on
+# file systems with coarse timestamps a file added in the same tick as
+# the scan wouldn't change the mtime again
+NOTE_INDEX_RACY_NS = 2 * 10**9
+
+# The only VEVENT properties the rest of the script looks at. Everything
+# else (attendees, alarms, attachments, ...) is dropped while streaming a
+# feed so large calendars don't have to be held in memory.
+VEVENT_FIELDS = {
+    "UID",
+    "SUMMARY",
+    "DTSTART",
+    "DTEND",
+    "DURATION",
+    "RRULE",
+    "EXDATE",
+    "RDATE",
+    "RECURRENCE-ID",
+    "URL",
+    "LOCATION",
+    "DESCRIPTION",
+    "SEQUENCE",
+    "LAST-MODIFIED",
+}
+
+# A location containing any of these is treated as a meeting link rather
+# than a place to look up on a map
+MEETING_LOCATION_MARKERS = [
+    "http://",
+    "https://",
+    "zoom.us",
+    "meet.google",
+    "teams.microsoft",
+]
+
+# Links in an event description pointing at one of these are shown as the
+# event's meeting link
+MEETING_PLATFORMS = [
+    "zoom.us",
+    "meet.google.com",
+    "teams.microsoft.com",
+]
+
+# The first link in a description that mentions one of MEETING_PLATFORMS
+# (in any case), found in a single scan. A link runs up to the next
+# whitespace, '<', '>' or '"'
+MEETING_LINK_PATTERN = re.compile(
+    r'(?:https?://|www\.)[^\s<>"]*?(?i:'
+    + "|".join(re.escape(platform) for platform in MEETING_PLATFORMS)
+    + r')[^\s<>"]*'
+)
+MEETING_LINK_END_PATTERN = re.compile(r'[\s<>"]')
+
+# Only this many characters of a description are searched for a meeting
+# link; invites put it near the top, ahead of pages of dial-in numbers
+MEETING_LINK_SCAN_LIMIT = 16384
+
+# Recurrence frequencies whose rules can be restarted a whole number of
+# periods later without changing the series, so expansion can jump close
+# to the requested dates instead of iterating from a DTSTART years back
+RESTARTABLE_FREQUENCIES = {
+    "DAILY": timedelta(days=1),
+    "WEEKLY": timedelta(weeks=1),
+}
+
+# Day numbers used by the occurrence index are proleptic ordinals
+# (date.toordinal()); NumPy counts days from 1970-01-01 instead
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
 CALENDAR_LABELS = {
     "personal": "(Personal 🗓️)",
     "events": "(Events 🎊)",
@@ -138,421 +338,2313 @@ EVENT_KEYWORDS = {
     "urgent": "‼️",
 }
 
+# How many rendered events (everything but the time) to keep around while
+# writing notes; recurring events reuse the same entry for every occurrence
+RENDER_CACHE_SIZE = 4096
+
+# Finds every keyword in a summary in one pass. The lookahead lets matches
+# overlap, and at each position the alternation tries keywords in
+# EVENT_KEYWORDS order, so the best match is the one with the lowest rank
+EVENT_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(keyword) for keyword in EVENT_KEYWORDS) + "))"
+)
+EVENT_KEYWORD_RANKS = {keyword: rank for rank, keyword in enumerate(EVENT_KEYWORDS)}
+
 
 # -------------------------------------------------------------------
 # 1. ICS FETCHING / PARSING
 # -------------------------------------------------------------------
 
 
-def clean_event(
-    event, calendar_type, start_datetime, end_datetime, target_date, events_for_date
-):
-    tz = ZoneInfo("America/New_York")
+@dataclass(frozen=True, slots=True)
+class CalendarEvent:
+    """
+    A single event occurrence, normalized once when the feed is parsed so
+    the index, fingerprints and renderer never touch raw ICS properties.
+    Timed events have start/end converted to the sync timezone;
+    all-day events start/end at midnight of their dates.
+    """
 
-    # Handle recurring events by checking if this instance occurs on target_date
-    try:
-        target_start = datetime.datetime.combine(
-            target_date, datetime.time.min, tzinfo=tz
-        )
-        target_end = datetime.datetime.combine(
-            target_date, datetime.time.max, tzinfo=tz
-        )
+    start: datetime.datetime
+    end: datetime.datetime
+    all_day: bool
+    summary: str
+    url: str
+    location: str
+    meeting_link: str
+    calendar_type: str
+    uid: str
+    sequence: int
+    last_modified: str
+    recurrence_id: str
+
+
+def find_meeting_link(location, description):
+    """
+    Returns (meeting_link, location) for an event: a location that is
+    itself a link becomes the meeting link, otherwise the first zoom/meet/
+    teams URL in the description is used. The returned location is
+    whitespace-normalized and empty when it was used as the link.
+    """
+    if location and any(
+        marker in location.lower() for marker in MEETING_LOCATION_MARKERS
+    ):
+        return location, ""
 
-        if hasattr(event, "recurring"):
-            recurring_instances = of(event).at(target_start)
-            if not any(
-                inst.begin <= target_end and inst.end >= target_start
-                for inst in recurring_instances
-            ):
-                return events_for_date
-    except Exception as e:
-        logger.error(f"Error processing recurring event: {str(event)}.\n{e}")
-        return events_for_date
+    location = " ".join(location.replace("\n", " ").split())
+    if description:
+        return find_description_meeting_link(description), location
+    return "", location
 
-    # Ensure event times are timezone-aware
-    try:
-        event_start = event.get("dtstart").dt
-        event_end = event.get("dtend").dt if event.get("dtend") else event_start
-
-        if isinstance(event_start, datetime.date) and not isinstance(
-            event_start, datetime.datetime
-        ):
-            event_start = datetime.datetime.combine(event_start, datetime.time.min)
-        if isinstance(event_end, datetime.date) and not isinstance(
-            event_end, datetime.datetime
-        ):
-            event_end = datetime.datetime.combine(event_end, datetime.time.min)
-    except (AttributeError, KeyError) as e:
-        logger.error(f"Event missing begin/end time: {str(event)}.\n{e}")
-        return events_for_date
-
-    if event_start.tzinfo is None:
-        event_start = event_start.replace(tzinfo=tz)
-    if event_end.tzinfo is None:
-        event_end = event_end.replace(tzinfo=tz)
-
-    # Check if it's an all-day event
-    try:
-        is_all_day = getattr(event, "all_day", False) or (
-            (event_end - event_start).days >= 1
-            and event_start.hour == 0
-            and event_start.minute == 0
-            and event_end.hour == 0
-            and event_end.minute == 0
-        )
-    except (TypeError, AttributeError) as e:
-        logger.error(f"Could not determine if all-day event: {event.name}.\n{e}")
-        return events_for_date
 
+@lru_cache(maxsize=1024)
+def find_description_meeting_link(description):
+    """
+    Returns the first zoom/meet/teams URL in the first
+    MEETING_LINK_SCAN_LIMIT characters of a description, or "".
+    Memoized, since every occurrence of a series shares its description.
+    """
+    # Stop at the end of the word the limit falls in, so a link running
+    # past the limit isn't cut off
+    scan_end = MEETING_LINK_END_PATTERN.search(description, MEETING_LINK_SCAN_LIMIT)
+    match = MEETING_LINK_PATTERN.search(
+        description, 0, scan_end.start() if scan_end else len(description)
+    )
+    return match.group() if match else ""
+
+
+def make_calendar_event(props, calendar_type, tz, start, end, all_day):
+    """
+    Builds a CalendarEvent for one occurrence of a streamed VEVENT, given
+    the occurrence's start/end (see vevent_times()).
+    """
+
+    def text(name):
+        return unescape_text(props[name][0][1]).strip() if name in props else ""
+
+    if not all_day and start.tzinfo is not tz:
+        start = start.astimezone(tz)
+        end = end.astimezone(tz)
+
+    meeting_link, location = find_meeting_link(text("LOCATION"), text("DESCRIPTION"))
     try:
-        if is_all_day:
-            start_date = event_start.date()
-            end_date = event_end.date() - timedelta(days=1)
-            if start_date <= target_date <= end_date:
-                events_for_date.append((event, calendar_type))
-        else:
-            if not (event_end < start_datetime or event_start > end_datetime):
-                events_for_date.append((event, calendar_type))
-    except (TypeError, ValueError) as e:
-        logger.error(f"Could not process event dates: {event.name}.\n{e}")
+        sequence = int(text("SEQUENCE") or 0)
+    except ValueError:
+        sequence = 0
+
+    return CalendarEvent(
+        start=start,
+        end=end,
+        all_day=all_day,
+        summary=text("SUMMARY") or "Untitled Event",
+        url=text("URL"),
+        location=location,
+        meeting_link=meeting_link,
+        calendar_type=calendar_type,
+        uid=text("UID"),
+        sequence=sequence,
+        last_modified=text("LAST-MODIFIED"),
+        recurrence_id=text("RECURRENCE-ID"),
+    )
 
-    return events_for_date
+
+def move_calendar_event(event, start, end, tz):
+    """
+    Returns a copy of a CalendarEvent at another occurrence's start/end,
+    so a series' text fields (and its meeting link) are only parsed once.
+    """
+    if not event.all_day and start.tzinfo is not tz:
+        start = start.astimezone(tz)
+        end = end.astimezone(tz)
+    return replace(event, start=start, end=end)
 
 
-def get_calendar_label(calendar_type):
-    """Returns the formatted calendar label with emoji for the given calendar type."""
-    return CALENDAR_LABELS.get(calendar_type, "(Other 🤷)")
+def event_day_span(event):
+    """
+    Returns the (first_day, last_day) range of dates, inclusive, that a
+    CalendarEvent covers. All-day events (and timed ones running from
+    midnight to midnight) cover their start date up to the day before
+    their end date; timed events cover every day they overlap.
+    """
+    start, end = event.start, event.end
+    is_all_day = event.all_day or (
+        (end - start).days >= 1
+        and start.hour == 0
+        and start.minute == 0
+        and end.hour == 0
+        and end.minute == 0
+    )
+    if is_all_day:
+        return start.date(), end.date() - timedelta(days=1)
+    return start.date(), end.date()
 
 
-def fetch_events_for_date(ics_urls_with_types, target_date):
+def event_day_span_arrays(events):
     """
-    Fetches and processes events, properly handling recurring events.
-    Returns a list of (expanded_event, calendar_type) tuples.
+    Vectorized event_day_span(): converts all occurrences to NumPy
+    datetime64 start/end arrays plus an all-day mask once, and returns the
+    first and last day ordinals of every event as int64 arrays.
     """
-    logger.info(f"Fetching events for date: {target_date}")
-    events_for_date = []
-    tz = ZoneInfo("America/New_York")
+    starts = np.array(
+        [event.start.replace(tzinfo=None) for event in events], dtype="datetime64[m]"
+    )
+    ends = np.array(
+        [event.end.replace(tzinfo=None) for event in events], dtype="datetime64[m]"
+    )
+    all_day = np.fromiter(
+        (event.all_day for event in events), dtype=bool, count=len(events)
+    )
 
-    start_datetime = datetime.datetime.combine(
-        target_date, datetime.time.min, tzinfo=tz
+    start_days = starts.astype("datetime64[D]")
+    end_days = ends.astype("datetime64[D]")
+    all_day |= (
+        (ends - starts >= np.timedelta64(1, "D"))
+        & (starts == start_days)
+        & (ends == end_days)
     )
-    end_datetime = datetime.datetime.combine(target_date, datetime.time.max, tzinfo=tz)
 
-    # Look back 1 year and forward 2 years from target date for recurring events
-    recurring_start = start_datetime - timedelta(days=365)
-    recurring_end = start_datetime + timedelta(days=730)
+    first_days = start_days.astype(np.int64) + EPOCH_ORDINAL
+    last_days = end_days.astype(np.int64) + EPOCH_ORDINAL - all_day
+    return first_days, last_days
 
-    for ics_url, calendar_type in ics_urls_with_types:
-        if not ics_url:
-            continue
 
-        try:
-            logger.info(f"Fetching calendar from: {ics_url[:50]}...")
-            resp = requests.get(ics_url)
-            resp.raise_for_status()
-        except requests.RequestException as e:
-            calendar_name = get_calendar_label(calendar_type)
-            logger.error(f"Request failed for {calendar_name}.\n{e}")
-            continue
+class OccurrenceIndex:
+    """
+    Interval index over one calendar's occurrences, keyed by the day span
+    each one covers (see event_day_span()). Occurrences are kept in an
+    array sorted by first day that doubles as an implicit balanced binary
+    tree: the middle of every [lo, hi) slice is a node, augmented with the
+    latest last day in its subtree. Range queries skip whole subtrees that
+    end too early or start too late, so they cost O(log n + k).
+    With NumPy available, by_day() maps many dates at once with array ops.
+    """
 
-        cal = icalendar.Calendar.from_ical(resp.content)
-
-        # Process each 'regular' event
-        for event in cal.events:
-            events_for_date = clean_event(
-                event,
-                calendar_type,
-                start_datetime,
-                end_datetime,
-                target_date,
-                events_for_date,
-            )
+    __slots__ = (
+        "_events",
+        "_orders",
+        "_first_days",
+        "_last_days",
+        "_max_last_days",
+        "_first_array",
+        "_last_array",
+    )
 
-        # Handle recurring events with proper date range
-        events_recurring = of(cal).between(recurring_start, recurring_end)
-        for event in events_recurring:
-            events_for_date = clean_event(
-                event,
-                calendar_type,
-                start_datetime,
-                end_datetime,
-                target_date,
-                events_for_date,
-            )
+    def __init__(self, events):
+        self._events = list(events)
+        self._first_array = self._last_array = None
+
+        if np is not None and self._events:
+            first_array, last_array = event_day_span_arrays(self._events)
+            orders = np.argsort(first_array, kind="stable")
+            self._first_array, self._last_array = first_array, last_array
+            self._orders = orders.tolist()
+            self._first_days = first_array[orders].tolist()
+            self._last_days = last_array[orders].tolist()
+        else:
+            spans = [event_day_span(event) for event in self._events]
+            self._orders = sorted(range(len(spans)), key=lambda i: spans[i][0])
+            self._first_days = [spans[i][0].toordinal() for i in self._orders]
+            self._last_days = [spans[i][1].toordinal() for i in self._orders]
+
+        self._max_last_days = list(self._last_days)
+        self._augment(0, len(self._events))
+
+    def __len__(self):
+        return len(self._events)
+
+    def _augment(self, lo, hi):
+        """Fills in the max last day of the subtree rooted at the middle of [lo, hi)."""
+        if lo >= hi:
+            return -1
+        mid = (lo + hi) // 2
+        self._max_last_days[mid] = max(
+            self._last_days[mid], self._augment(lo, mid), self._augment(mid + 1, hi)
+        )
+        return self._max_last_days[mid]
+
+    def overlapping(self, first_day, last_day):
+        """
+        Returns the events covering any day in [first_day, last_day], in the
+        order they were added to the index.
+        """
+        first, last = first_day.toordinal(), last_day.toordinal()
+        found = []
+        pending = [(0, len(self._events))]
+        while pending:
+            lo, hi = pending.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_last_days[mid] < first:
+                continue
+            pending.append((lo, mid))
+            if self._first_days[mid] > last:
+                continue
+            if self._last_days[mid] >= first:
+                found.append(self._orders[mid])
+            pending.append((mid + 1, hi))
+
+        return [self._events[i] for i in sorted(found)]
+
+    def by_day(self, target_dates):
+        """
+        Maps each of target_dates to the events covering it, in the order
+        they were added. With NumPy this is a handful of array operations
+        over all occurrences instead of one tree query per date.
+        """
+        dates = sorted(set(target_dates))
+        if self._first_array is None:
+            return {day: self.overlapping(day, day) for day in dates}
+
+        # For every event, the run of target days it covers is [lo, hi)
+        days = np.array([day.toordinal() for day in dates], dtype=np.int64)
+        lo = np.searchsorted(days, self._first_array, side="left")
+        hi = np.searchsorted(days, self._last_array, side="right")
+        counts = np.maximum(hi - lo, 0)
+
+        # Expand the runs into (day, event) pairs and group them by day; the
+        # stable sort keeps events in the order they were added
+        event_ids = np.repeat(np.arange(len(self._events)), counts)
+        run_offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        day_ids = np.repeat(lo, counts) + run_offsets
+        order = np.argsort(day_ids, kind="stable")
+        day_ids, event_ids = day_ids[order], event_ids[order].tolist()
+        bounds = np.searchsorted(day_ids, np.arange(len(dates) + 1)).tolist()
 
-    logger.info(f"Found {len(events_for_date)} events for {target_date}")
-    return events_for_date
+        return {
+            day: [self._events[i] for i in event_ids[start:stop]]
+            for day, start, stop in zip(dates, bounds, bounds[1:])
+        }
 
 
-# -------------------------------------------------------------------
-# 2. NOTE UPDATING
-# -------------------------------------------------------------------
+def get_calendar_label(calendar_type):
+    """Returns the formatted calendar label with emoji for the given calendar type."""
+    return CALENDAR_LABELS.get(calendar_type, "(Other 🤷)")
+
 
+def hash_text(text):
+    """Returns a short, stable hash of a string or bytes."""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return hashlib.sha256(text).hexdigest()[:32]
 
-def remove_all_calendar_sections(content):
+
+def feed_cache_paths(ics_url):
     """
-    Removes all calendar sections from the content, regardless of slight
-    header variations.
-    Returns (cleaned_content, number_of_sections_removed)
+    Returns the (body_path, meta_path, parsed_path) cache files for a feed.
+    Files are keyed by a hash of the URL so secret feed URLs never end up
+    in file names.
     """
-    lines = content.splitlines()
-    new_lines = []
-    in_calendar_section = False
-    sections_removed = 0
+    key = hashlib.sha256(ics_url.encode("utf-8")).hexdigest()[:32]
+    base_path = os.path.join(CACHE_DIR, key)
+    return base_path + ".ics", base_path + ".json", base_path + ".pickle"
 
-    for line in lines:
-        # Check for any variation of calendar headers
-        if (
-            line.strip().lower().startswith(("#", "##", "###"))
-            and "calendar" in line.strip().lower()
-        ):
-            in_calendar_section = True
-            sections_removed += 1
-            continue
 
-        if in_calendar_section:
-            if line.strip().startswith(("#", "##", "###")):
-                in_calendar_section = False
-                new_lines.append(line)  # Keep that header
-        else:
-            new_lines.append(line)
+def load_cached_feed(ics_url):
+    """
+    Returns the metadata of a previously downloaded feed: its 'etag' and
+    'last_modified' validators and the 'digest' of its body.
+    Returns None if the feed isn't cached.
+    """
+    body_path, meta_path, _ = feed_cache_paths(ics_url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not meta.get("digest") or not os.path.exists(body_path):
+        return None
+    return meta
+
 
-    return "\n".join(new_lines), sections_removed
+def conditional_headers(meta):
+    """Returns the request headers revalidating a cached feed (see load_cached_feed())."""
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
 
 
-def format_events_as_markdown(events_with_types):
+def save_cached_feed(ics_url, resp):
     """
-    Takes a list of (event, calendar_type) tuples and returns a
-    markdown string without appending any timezone abbreviations.
+    Streams a feed's body to the cache in chunks, hashing it on the way,
+    and stores its validators so the next run can send a conditional
+    request. The body is never held in memory as a whole.
+    Returns the digest of the body.
     """
-    if not events_with_types:
-        return "_No events today_\n"
+    body_path, _, _ = feed_cache_paths(ics_url)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    digest = hashlib.sha256()
+    temp_path = body_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            digest.update(chunk)
+            f.write(chunk)
+    os.replace(temp_path, body_path)
+    return save_cached_feed_meta(ics_url, resp.headers, digest.hexdigest()[:32])
+
+
+def save_cached_feed_meta(ics_url, headers, digest):
+    """Stores the validators and digest of a freshly cached feed body."""
+    _, meta_path, _ = feed_cache_paths(ics_url)
+    meta = {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "digest": digest,
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return digest
+
+
+def create_http_session(pool_size):
+    """
+    Returns a requests.Session whose connection pool can keep one
+    connection per feed open, so all downloads share TCP/TLS connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    seen_events = set()
-    lines = []
-    tz = ZoneInfo("America/New_York")
 
-    for evt, cal_type in events_with_types:
-        event_id = (evt.get("summary", ""), evt.get("dtstart").dt, cal_type)
-        if event_id in seen_events:
-            continue
-        seen_events.add(event_id)
+def describe_fetch_error(e):
+    """
+    Describes why a feed download failed without the exception's message,
+    which often contains the feed URL and with it the calendar's secret
+    token: the HTTP status if the server answered, otherwise the error type.
+    """
+    response = getattr(e, "response", None)
+    if response is not None:
+        return f"HTTP {response.status_code}"
+    return type(e).__name__
 
-        event_name = evt.get("summary", "Untitled Event")
-        start_time = evt.get("dtstart").dt
-        end_time = evt.get("dtend").dt if evt.get("dtend") else start_time
 
-        # Check if this is an all-day event
-        is_all_day = isinstance(start_time, datetime.date) and not isinstance(
-            start_time, datetime.datetime
-        )
+def fetch_calendar_feed(session, ics_url, calendar_type, timeout=FETCH_TIMEOUT):
+    """
+    Downloads a single ICS feed into the cache. Feeds cached by a previous
+    run are revalidated with ETag / If-Modified-Since and reused when the
+    server answers 304 Not Modified.
+    Returns the digest of the feed body, or None if it could not be fetched.
+    """
+    meta = load_cached_feed(ics_url)
+    headers = conditional_headers(meta)
 
-        if not is_all_day:
-            if start_time.tzinfo is None:
-                start_time = start_time.replace(tzinfo=tz)
-            if end_time.tzinfo is None:
-                end_time = end_time.replace(tzinfo=tz)
-            start_time_str = start_time.astimezone(tz).strftime("%H:%M")
-            end_time_str = end_time.astimezone(tz).strftime("%H:%M")
+    try:
+        logger.info(f"Fetching calendar from: {ics_url[:50]}...")
+        with session.get(
+            ics_url, headers=headers, timeout=timeout, stream=True
+        ) as resp:
+            if resp.status_code == 304 and meta is not None:
+                logger.info("Calendar not modified, using cached copy")
+                return meta["digest"]
+            resp.raise_for_status()
+            return save_cached_feed(ics_url, resp)
+    except (requests.RequestException, OSError) as e:
+        calendar_name = get_calendar_label(calendar_type)
+        logger.error(f"Request failed for {calendar_name}: {describe_fetch_error(e)}")
+        return None
 
-        calendar_name = CALENDAR_LABELS.get(cal_type, "(Other 🤷)")
 
-        # Pick an emoji based on event keywords
-        event_emoji = "📅"
-        event_lower = event_name.lower()
-        for keyword, emoji in EVENT_KEYWORDS.items():
-            if keyword in event_lower:
-                event_emoji = emoji
-                break
+def unique_calendar_feeds(ics_urls_with_types):
+    """Returns a dict mapping each configured ics_url, once, to its calendar_type."""
+    unique_feeds = {}
+    for ics_url, calendar_type in ics_urls_with_types:
+        if ics_url and ics_url not in unique_feeds:
+            unique_feeds[ics_url] = calendar_type
+    return unique_feeds
 
-        # Construct the main event link (URL or fallback search link)
-        if evt.get("url"):
-            event_text = f"[{event_name}]({evt.get('url')})"
-        else:
-            search_query = event_name.replace(" ", "+")
-            google_cal_link = (
-                f"https://calendar.google.com/calendar/u/0/r/search?q={search_query}"
+
+def fetch_calendar_feeds(ics_urls_with_types, timeout=FETCH_TIMEOUT):
+    """
+    Downloads every configured ICS feed exactly once, in parallel over a
+    shared connection pool, into the on-disk feed cache.
+    Returns a dict mapping each ics_url to the digest of its cached body;
+    feeds that could not be fetched are left out.
+    """
+    unique_feeds = unique_calendar_feeds(ics_urls_with_types)
+    feeds = {}
+    if not unique_feeds:
+        return feeds
+
+    with create_http_session(len(unique_feeds)) as session:
+        with ThreadPoolExecutor(max_workers=len(unique_feeds)) as executor:
+            results = executor.map(
+                lambda item: fetch_calendar_feed(session, *item, timeout=timeout),
+                unique_feeds.items(),
             )
-            event_text = f"[{event_name}]({google_cal_link})"
-
-        # Handle location
-        event_details = []
-        location_details = []
-        location = evt.get("location", "").strip()
-        if location:
-            if any(
-                domain in location.lower()
-                for domain in [
-                    "http://",
-                    "https://",
-                    "zoom.us",
-                    "meet.google",
-                    "teams.microsoft",
-                ]
-            ):
-                event_details.append(f"🔗 [Join meeting]({location})")
-            else:
-                clean_location = " ".join(location.replace("\n", " ").split())
-                maps_query = clean_location.replace(" ", "+")
-                maps_link = (
-                    f"https://www.google.com/maps/search/?api=1&query={maps_query}"
-                )
-                location_details.append(f"📍 [{clean_location}]({maps_link})")
-
-        # Handle description for possible meeting links
-        description = evt.get("description", "").strip()
-        if description:
-            urls = re.findall(r'https?://[^\s<>"]+|www\.[^\s<>"]+', description)
-            for url in urls:
-                if any(
-                    platform in url.lower()
-                    for platform in [
-                        "zoom.us",
-                        "meet.google.com",
-                        "teams.microsoft.com",
-                    ]
-                ):
-                    if not any("Join meeting" in detail for detail in event_details):
-                        event_details.append(f"🔗 [Join meeting]({url})")
-                        break
+            for ics_url, digest in zip(unique_feeds, results):
+                if digest is not None:
+                    feeds[ics_url] = digest
+
+    logger.info(f"Fetched {len(feeds)} calendar feed(s)")
+    return feeds
 
-        # Final line
-        if is_all_day:
-            line = f"- 📅 {event_text} {event_emoji} `{calendar_name}`\n"
-        else:
-            line = f"- **{start_time_str} - {end_time_str}** {event_text} `{calendar_name}`\n"
 
-        # Indent additional details
-        if event_details:
-            line += "".join(f"    - {detail}\n" for detail in event_details)
-        if location_details:
-            line += "".join(f"    - {loc}\n" for loc in location_details)
+async def fetch_calendar_feed_async(client, ics_url, calendar_type):
+    """
+    Async fetch_calendar_feed() over an httpx.AsyncClient: revalidates or
+    downloads a single ICS feed into the cache.
+    Returns the digest of the feed body, or None if it could not be fetched.
+    """
+    meta = await asyncio.to_thread(load_cached_feed, ics_url)
+    headers = conditional_headers(meta)
 
-        lines.append(line.rstrip())
+    try:
+        logger.info(f"Fetching calendar from: {ics_url[:50]}...")
+        async with client.stream("GET", ics_url, headers=headers) as resp:
+            if resp.status_code == 304 and meta is not None:
+                logger.info("Calendar not modified, using cached copy")
+                return meta["digest"]
+            resp.raise_for_status()
 
-    return "\n".join(lines) + "\n"
+            # Same as save_cached_feed(), but with the file I/O on threads
+            body_path, _, _ = feed_cache_paths(ics_url)
+            await asyncio.to_thread(os.makedirs, CACHE_DIR, exist_ok=True)
+            digest = hashlib.sha256()
+            temp_path = body_path + ".tmp"
+            f = await asyncio.to_thread(open, temp_path, "wb")
+            try:
+                async for chunk in resp.aiter_bytes(64 * 1024):
+                    digest.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, temp_path, body_path)
+            return await asyncio.to_thread(
+                save_cached_feed_meta, ics_url, resp.headers, digest.hexdigest()[:32]
+            )
+    except (httpx.HTTPError, httpx.InvalidURL, httpx.StreamError, OSError) as e:
+        calendar_name = get_calendar_label(calendar_type)
+        logger.error(f"Request failed for {calendar_name}: {describe_fetch_error(e)}")
+        return None
 
 
-def insert_calendar_at_top(note_content, events_md):
+async def fetch_calendar_feeds_async(ics_urls_with_types, timeout=FETCH_TIMEOUT):
     """
-    Inserts the calendar events after a known table (if present)
-    but before the rest of the note.
+    Async fetch_calendar_feeds(): downloads every feed concurrently with
+    httpx, or runs fetch_calendar_feeds() on a thread if httpx isn't
+    installed, so the event loop never waits on the network.
+    Returns a dict mapping each ics_url to the digest of its cached body.
     """
-    lines = note_content.splitlines()
-    table_end_idx = -1
+    if httpx is None:
+        return await asyncio.to_thread(
+            fetch_calendar_feeds, ics_urls_with_types, timeout
+        )
+
+    unique_feeds = unique_calendar_feeds(ics_urls_with_types)
+    feeds = {}
+    if not unique_feeds:
+        return feeds
+
+    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+        digests = await asyncio.gather(
+            *(
+                fetch_calendar_feed_async(client, ics_url, calendar_type)
+                for ics_url, calendar_type in unique_feeds.items()
+            ),
+            return_exceptions=True,
+        )
+    # Anything fetch_calendar_feed_async() didn't expect (e.g. an invalid
+    # port surfacing from the transport) fails that feed, not the sync
+    for (ics_url, calendar_type), digest in zip(unique_feeds.items(), digests):
+        if isinstance(digest, Exception):
+            calendar_name = get_calendar_label(calendar_type)
+            logger.error(
+                f"Request failed for {calendar_name}: {describe_fetch_error(digest)}"
+            )
+        elif digest is not None:
+            feeds[ics_url] = digest
 
-    for i, line in enumerate(lines):
-        if "|" in line and "[[" in line and "]]" in line:
-            table_end_idx = i
+    logger.info(f"Fetched {len(feeds)} calendar feed(s)")
+    return feeds
 
-    if table_end_idx == -1:
-        return HEADER_CALENDAR_EVENTS + "\n" + events_md + note_content
 
-    before = lines[: table_end_idx + 1]
-    after = lines[table_end_idx + 1 :]  # noqa: E203
-    return (
-        "\n".join(before)
-        + "\n\n"
-        + HEADER_CALENDAR_EVENTS
-        + events_md
-        + "\n"
-        + "\n".join(after)
-    )
+def iter_content_lines(byte_lines):
+    """
+    Unfolds raw ICS lines (lines starting with a space or tab belong to
+    the previous line) and decodes each logical line. Unfolding happens on
+    bytes since a fold may split a multi-byte UTF-8 character.
+    Yields one logical content line at a time.
+    """
+    current = None
+    for raw_line in byte_lines:
+        line = raw_line.rstrip(b"\r\n")
+        if line[:1] in (b" ", b"\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current.decode("utf-8", errors="replace")
+        current = bytearray(line)
+    if current:
+        yield current.decode("utf-8", errors="replace")
 
 
-def update_note(file_path, events):
+def split_content_line(line):
     """
-    Load the file, remove all calendar sections, then add the new one at
-    the top.
+    Splits a content line like 'DTSTART;TZID=America/New_York:20240101T090000'
+    into (name, params, value). Quoted parameter values may contain ':'.
     """
-    logger.info(f"Updating note: {file_path}")
-    if os.path.exists(file_path):
-        logger.info("File exists, reading content...")
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ":" and not in_quotes:
+            head, value = line[:i], line[i + 1 :]  # noqa: E203
+            break
     else:
-        logger.info("File doesn't exist, starting with blank content")
-        content = ""
+        head, value = line, ""
 
-    content_no_old, sections_removed = remove_all_calendar_sections(content)
-    if sections_removed > 0:
-        logger.info(f"Removed {sections_removed} calendar section(s)")
+    name, *raw_params = head.split(";")
+    params = {}
+    for raw_param in raw_params:
+        key, _, param_value = raw_param.partition("=")
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
 
-    events_md = format_events_as_markdown(events)
-    updated_content = insert_calendar_at_top(content_no_old, events_md)
 
-    logger.info(f"Writing updated content with {len(events)} events")
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(updated_content)
+@lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Returns the ZoneInfo for an IANA name like 'America/New_York', or None
+    if it's unknown. Cached, since feeds repeat the same few TZIDs on
+    every event.
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
 
 
-# -------------------------------------------------------------------
-# 3. MAIN LOGIC
-# -------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def get_event_timezone(tzid):
+    """
+    Resolves an event's TZID to a ZoneInfo: an IANA name, a Windows zone
+    name (see WINDOWS_TIMEZONES) or a custom ID ending in an IANA name,
+    like '/mozilla.org/20050126_1/Europe/Berlin'. VTIMEZONE definitions
+    aren't read, so any other TZID logs a warning (once) and returns None.
+    """
+    tzid = tzid.strip()
+    zone = get_timezone(WINDOWS_TIMEZONES.get(tzid, tzid))
+    if zone is not None:
+        return zone
+
+    parts = tzid.strip("/").split("/")
+    for i in range(1, len(parts)):
+        zone = get_timezone("/".join(parts[i:]))
+        if zone is not None:
+            return zone
+
+    logger.warning(
+        f"Unknown timezone '{tzid}', showing its events in the sync timezone"
+    )
+    return None
 
 
-def extract_date_from_filename(filename):
+def parse_ical_datetime(value, params, tz):
     """
-    Attempt to parse 'mm-dd-yyyy' from filenames like '12-21-2024 (Sat) 📝.md'
-    Return a datetime.date object or None if not parseable.
+    Parses an ICS DATE or DATE-TIME value (the first one, for lists) into a
+    timezone-aware datetime. Dates become midnight in tz.
+    Returns None if the value can't be parsed.
+    """
+    value = value.split(",")[0].strip()
+    try:
+        if len(value) == 8:
+            return datetime.datetime.strptime(value, "%Y%m%d").replace(tzinfo=tz)
+        if value.endswith("Z"):
+            return datetime.datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(
+                tzinfo=datetime.timezone.utc
+            )
+        naive = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        return None
+
+    zone = get_event_timezone(params["TZID"]) if params.get("TZID") else None
+    return naive.replace(tzinfo=zone or tz)
+
+
+def is_date_value(value, params):
+    """Returns True if an ICS date/time value is a DATE rather than a DATE-TIME."""
+    return params.get("VALUE", "").upper() == "DATE" or len(value.strip()) == 8
+
+
+def parse_ical_duration(value):
     """
-    pattern = re.compile(r"(\d{2})-(\d{2})-(\d{4})")
-    match = pattern.search(filename)
+    Parses an ICS DURATION value like 'PT1H30M' or '-P1D' into a timedelta.
+    Returns None if the value can't be parsed.
+    """
+    match = re.fullmatch(
+        r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?",
+        value.strip().upper(),
+    )
     if not match:
         return None
-    month, day, year = match.groups()
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(
+        weeks=int(weeks or 0),
+        days=int(days or 0),
+        hours=int(hours or 0),
+        minutes=int(minutes or 0),
+        seconds=int(seconds or 0),
+    )
+    return -duration if sign == "-" else duration
+
+
+def unescape_text(value):
+    """Undoes ICS TEXT escaping ('\\n', '\\,', '\\;' and '\\\\')."""
+    return re.sub(
+        r"\\([\\;,nN])",
+        lambda match: "\n" if match.group(1) in "nN" else match.group(1),
+        value,
+    )
+
+
+def vevent_times(props, tz):
+    """
+    Returns (start, end, all_day) for a streamed VEVENT from its DTSTART
+    and DTEND or DURATION, or None if it has no readable start. Events
+    without an end last one day if all-day and no time otherwise.
+    """
+    if "DTSTART" not in props:
+        return None
+    params, value = props["DTSTART"][0]
+    start = parse_ical_datetime(value, params, tz)
+    if start is None:
+        return None
+    all_day = is_date_value(value, params)
+
+    end = None
+    if "DTEND" in props:
+        end = parse_ical_datetime(props["DTEND"][0][1], props["DTEND"][0][0], tz)
+    elif "DURATION" in props:
+        duration = parse_ical_duration(props["DURATION"][0][1])
+        end = start + duration if duration is not None else None
+    if end is None:
+        end = start + timedelta(days=1) if all_day else start
+    return start, end, all_day
+
+
+def vevent_may_overlap(props, window_start, window_end, tz):
+    """
+    Decides from a VEVENT's raw properties whether any of its occurrences
+    could overlap [window_start, window_end]. Errs on the side of keeping
+    events whose times can't be read.
+    """
+    times = vevent_times(props, tz)
+    if times is None:
+        return True
+    start, end, _ = times
+
+    # A moved occurrence also has to be kept if the slot it replaces is in
+    # the window, otherwise the original occurrence would come back
+    if "RECURRENCE-ID" in props:
+        params, value = props["RECURRENCE-ID"][0]
+        recurrence_id = parse_ical_datetime(value, params, tz)
+        if recurrence_id is None or window_start <= recurrence_id <= window_end:
+            return True
+
+    # No occurrence of an event or series can start after its DTSTART
+    if start > window_end:
+        return False
+
+    if "RDATE" in props:
+        return True
+    if "RRULE" in props:
+        until = re.search(r"UNTIL=([0-9TZ]+)", props["RRULE"][0][1].upper())
+        if not until:
+            return True
+        last_start = parse_ical_datetime(until.group(1), props["DTSTART"][0][0], tz)
+        duration = max(end - start, timedelta(0))
+        return last_start is None or last_start + duration >= window_start
+
+    return end >= window_start
+
+
+def stream_calendar(byte_lines, window_start, window_end, tz):
+    """
+    Reads an ICS feed line by line and keeps only the VEVENTs that may
+    overlap [window_start, window_end], trimmed to VEVENT_FIELDS. Peak
+    memory is bounded by the events in the window, not the feed size.
+    Returns (vevents, events_dropped) where each vevent maps a property
+    name to its list of (params, value) pairs.
+    """
+    vevents = []
+    events_dropped = 0
+    component_stack = []
+    vevent_props = None
+
+    for line in iter_content_lines(byte_lines):
+        name, params, value = split_content_line(line)
+
+        if name == "BEGIN":
+            component_stack.append(value.upper())
+            if component_stack == ["VCALENDAR", "VEVENT"]:
+                vevent_props = {}
+        elif name == "END":
+            if component_stack == ["VCALENDAR", "VEVENT"]:
+                if vevent_may_overlap(vevent_props, window_start, window_end, tz):
+                    vevents.append(vevent_props)
+                else:
+                    events_dropped += 1
+                vevent_props = None
+            if component_stack:
+                component_stack.pop()
+        elif component_stack == ["VCALENDAR", "VEVENT"] and name in VEVENT_FIELDS:
+            # Properties of nested components (VALARM) are skipped as well
+            vevent_props.setdefault(name, []).append((params, value))
+
+    return vevents, events_dropped
+
+
+def localize_rrule(rrule, zone):
+    """
+    Rewrites a UTC UNTIL in an RRULE into the series' local wall time so
+    it can be expanded against a naive DTSTART.
+    """
+    parts = []
+    for part in rrule.split(";"):
+        key, _, value = part.partition("=")
+        if key.upper() == "UNTIL" and value.upper().endswith("Z"):
+            until = parse_ical_datetime(value, {}, zone)
+            if until is not None:
+                value = until.astimezone(zone).strftime("%Y%m%dT%H%M%S")
+        parts.append(f"{key}={value}")
+    return ";".join(parts)
+
+
+def restart_rrule_at(rrule, naive_start, lower):
+    """
+    Returns the latest occurrence of a DAILY/WEEKLY rule at or before
+    `lower`, to be used as the rule's DTSTART so expansion doesn't have to
+    walk every occurrence since the series began. Rules that count
+    occurrences (COUNT) or use other frequencies start at naive_start.
+    """
+    fields = {}
+    for part in rrule.upper().split(";"):
+        key, _, value = part.partition("=")
+        fields[key] = value
+
+    period = RESTARTABLE_FREQUENCIES.get(fields.get("FREQ"))
+    if period is None or "COUNT" in fields or lower <= naive_start:
+        return naive_start
     try:
-        return datetime.date(int(year), int(month), int(day))
+        step = period * int(fields.get("INTERVAL") or 1)
     except ValueError:
-        return None
+        return naive_start
+    return naive_start + ((lower - naive_start) // step) * step
 
 
-def main():
+def iter_series_starts(props, start, end, spans, tz):
     """
-    - Find all markdown files in a specified directory (e.g. ./TODO/),
-      excluding any path that contains '/Archive/' or '/Weekly/'.
-    - For each file, parse the date from the filename.
-    - Fetch ICS events for that date from multiple calendars.
-    - Update the file with the new events at the top.
+    Lazily yields the start of every occurrence of a recurring master
+    (RRULE, RDATE, minus EXDATE) that overlaps one of the sorted,
+    non-overlapping spans. Occurrences are generated in order starting
+    near the first span and generation stops after the last one, so
+    infinite rules only cost the occurrences up to the requested dates.
+    Expansion happens in the series' own wall time so occurrences keep
+    their local time across DST changes.
     """
-    logger.info("Starting calendar update script...")
+    zone = start.tzinfo
+    naive_start = start.replace(tzinfo=None)
+    duration = max(end - start, timedelta(0))
+    windows = [
+        (
+            span_start.astimezone(zone).replace(tzinfo=None) - duration,
+            span_end.astimezone(zone).replace(tzinfo=None),
+        )
+        for span_start, span_end in spans
+    ]
 
-    # Define calendar URLs with their types (replace with your own environment variables or strings)
-    calendar_configs = [
-        (os.getenv("GOOGLE_CALENDAR_PERSONAL"), "personal"),
-        (os.getenv("GOOGLE_CALENDAR_EVENTS"), "events"),
-        (os.getenv("GOOGLE_CALENDAR_HOLIDAYS_US"), "us_holidays"),
+    def to_naive(value, params):
+        parsed = parse_ical_datetime(value, params, tz)
+        return parsed.astimezone(zone).replace(tzinfo=None) if parsed else None
+
+    series = rruleset()
+    series.rdate(naive_start)
+    for _, rrule in props.get("RRULE", []):
+        rule_start = restart_rrule_at(rrule, naive_start, windows[0][0])
+        series.rrule(rrulestr(localize_rrule(rrule, zone), dtstart=rule_start))
+    for name, add in (("RDATE", series.rdate), ("EXDATE", series.exdate)):
+        for params, values in props.get(name, []):
+            for value in values.split(","):
+                parsed = to_naive(value, params)
+                if parsed is not None:
+                    add(parsed)
+
+    window_index = 0
+    for occurrence in series:
+        while occurrence > windows[window_index][1]:
+            window_index += 1
+            if window_index == len(windows):
+                return
+        if occurrence >= windows[window_index][0]:
+            yield occurrence.replace(tzinfo=zone)
+
+
+def expand_vevents(vevents, calendar_type, spans, tz):
+    """
+    Single-pass overlap engine: classifies each VEVENT once as a single
+    event, a recurring master or an override of one occurrence
+    (RECURRENCE-ID), and returns every occurrence overlapping one of the
+    spans (see date_spans()) exactly once as a CalendarEvent.
+    Singles and overrides come first in feed order, followed by each
+    series' occurrences in time order.
+    """
+    span_ends = [span_end for _, span_end in spans]
+
+    def overlaps_spans(start, end):
+        i = bisect.bisect_left(span_ends, start)
+        return i < len(spans) and spans[i][0] <= end
+
+    events = []
+    masters = []
+    overridden = {}
+
+    for props in vevents:
+        times = vevent_times(props, tz)
+        if times is None:
+            logger.error(f"Event missing begin time: {props.get('SUMMARY')}")
+            continue
+        start, end, all_day = times
+
+        if "RECURRENCE-ID" in props:
+            params, value = props["RECURRENCE-ID"][0]
+            recurrence_id = parse_ical_datetime(value, params, tz)
+            uid = props.get("UID", [({}, "")])[0][1]
+            overridden.setdefault(uid, set()).add(recurrence_id)
+        elif "RRULE" in props or "RDATE" in props:
+            masters.append((props, start, end, all_day))
+            continue
+
+        if overlaps_spans(start, end):
+            events.append(
+                make_calendar_event(props, calendar_type, tz, start, end, all_day)
+            )
+
+    for props, start, end, all_day in masters:
+        replaced = overridden.get(props.get("UID", [({}, "")])[0][1], set())
+        series = make_calendar_event(props, calendar_type, tz, start, end, all_day)
+        try:
+            for occurrence_start in iter_series_starts(props, start, end, spans, tz):
+                if occurrence_start in replaced:
+                    continue
+                occurrence_end = occurrence_start + (end - start)
+                events.append(
+                    move_calendar_event(series, occurrence_start, occurrence_end, tz)
+                )
+        except (ValueError, TypeError, OverflowError) as e:
+            logger.error(
+                f"Could not expand recurring event: {props.get('SUMMARY')}.\n{e}"
+            )
+
+    return events
+
+
+def load_calendar(ics_url, digest, window_start, window_end, tz):
+    """
+    Streams a cached feed into the list of VEVENTs that may overlap the
+    window. The result is cached on disk per feed digest and window, so
+    unchanged feeds skip parsing entirely.
+    """
+    body_path, _, parsed_path = feed_cache_paths(ics_url)
+    cache_key = (
+        digest,
+        window_start.isoformat(),
+        window_end.isoformat(),
+        str(tz),
+        script_fingerprint(),
+    )
+
+    try:
+        with open(parsed_path, "rb") as f:
+            cached_key, vevents = pickle.load(f)
+        if cached_key == cache_key:
+            return vevents
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass
+
+    with open(body_path, "rb") as f:
+        vevents, events_dropped = stream_calendar(f, window_start, window_end, tz)
+    logger.info(
+        f"Kept {len(vevents)} event(s), dropped {events_dropped} outside the window"
+    )
+
+    try:
+        with open(parsed_path, "wb") as f:
+            pickle.dump((cache_key, vevents), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logger.warning(f"Could not cache parsed calendar.\n{e}")
+    return vevents
+
+
+def date_spans(target_dates, tz):
+    """
+    Groups dates into the sorted [start, end] datetime windows that need
+    expanding. Each date is padded by a day on both sides, so events that
+    only touch the edge of a note's day (e.g. ending exactly at midnight)
+    are still seen, and windows that overlap or touch are merged.
+    """
+    day_spans = []
+    for day in sorted(set(target_dates)):
+        first_day, last_day = day - timedelta(days=1), day + timedelta(days=1)
+        if day_spans and first_day <= day_spans[-1][1] + timedelta(days=1):
+            day_spans[-1][1] = last_day
+        else:
+            day_spans.append([first_day, last_day])
+
+    return [
+        (
+            datetime.datetime.combine(first_day, datetime.time.min, tzinfo=tz),
+            datetime.datetime.combine(last_day, datetime.time.max, tzinfo=tz),
+        )
+        for first_day, last_day in day_spans
     ]
-    ics_urls_with_types = [(url, cal_type) for url, cal_type in calendar_configs if url]
 
-    todo_dir = "TODO"
-    logger.info(f"Scanning directory: {todo_dir}")
 
-    files_processed = 0
-    skip_dirs = ["Archive", "Weekly"]
+def build_occurrence_indexes(ics_urls_with_types, target_dates, feeds, tz):
+    """
+    Parses each calendar once and recurrence-expands it only around the
+    requested dates, returning a list of (calendar_type, OccurrenceIndex)
+    pairs, in calendar order, that those dates can be queried from.
+    Event times are converted to tz.
+    """
+    spans = date_spans(target_dates, tz)
+    if not spans:
+        return []
+    range_start, range_end = spans[0][0], spans[-1][1]
 
-    for root, dirs, files in os.walk(todo_dir):
-        if any(skip_dir in root.split(os.sep) for skip_dir in skip_dirs):
-            logger.info(f"Skipping directory: {root}")
+    occurrence_indexes = []
+    for ics_url, calendar_type in ics_urls_with_types:
+        if ics_url not in feeds:
             continue
 
-        for filename in files:
-            if not filename.lower().endswith(".md"):
-                continue
+        logger.info(f"Expanding {get_calendar_label(calendar_type)} events...")
+        try:
+            vevents = load_calendar(ics_url, feeds[ics_url], range_start, range_end, tz)
+        except (OSError, ValueError) as e:
+            calendar_name = get_calendar_label(calendar_type)
+            logger.error(f"Could not read {calendar_name} feed.\n{e}")
+            continue
 
-            file_path = os.path.join(root, filename)
-            file_date = extract_date_from_filename(filename)
+        events = expand_vevents(vevents, calendar_type, spans, tz)
+        occurrence_indexes.append((calendar_type, OccurrenceIndex(events)))
 
-            if not file_date:
-                logger.info(f"Skipping file (no date found): {filename}")
-                continue
+    return occurrence_indexes
+
+
+def build_event_index(ics_urls_with_types, target_dates, feeds, tz=None):
+    """
+    Parses and recurrence-expands each calendar once, around every date in
+    target_dates, and looks each date up in the resulting occurrence
+    indexes. Days are counted in tz (default: CALENDAR_TIMEZONE).
+    Returns a dict mapping each target date to a list of CalendarEvents.
+    """
+    event_index = {target_date: [] for target_date in target_dates}
+    if not event_index:
+        return event_index
+
+    if tz is None:
+        tz = parse_timezone(CALENDAR_TIMEZONE)
+    occurrence_indexes = build_occurrence_indexes(
+        ics_urls_with_types, event_index, feeds, tz
+    )
+    for _, occurrence_index in occurrence_indexes:
+        for target_date, events in occurrence_index.by_day(event_index).items():
+            event_index[target_date].extend(events)
 
-            logger.info(f"Processing file: {filename}")
-            events = fetch_events_for_date(ics_urls_with_types, file_date)
-            update_note(file_path, events)
-            files_processed += 1
+    return event_index
 
-    logger.info(f"Finished processing {files_processed} files")
+
+def fingerprint_day_events(events):
+    """
+    Fingerprints one day's events per calendar so a note only needs to be
+    re-rendered when its own day changed, not whenever its feed changed.
+    Each event contributes its UID, start/end, SEQUENCE and LAST-MODIFIED;
+    events without LAST-MODIFIED also contribute the fields that get
+    rendered, since edits to them would otherwise go unnoticed.
+    Returns a dict mapping calendar_type to a hash of that bucket.
+    """
+    buckets = {}
+    for event in events:
+        fields = [
+            event.uid,
+            event.start.isoformat(),
+            event.end.isoformat(),
+            str(event.sequence),
+            event.last_modified,
+        ]
+        if not event.last_modified:
+            fields += [event.summary, event.url, event.location, event.meeting_link]
+        buckets.setdefault(event.calendar_type, []).append("\x1f".join(fields))
+    return {
+        calendar_type: hash_text("\x1e".join(bucket))
+        for calendar_type, bucket in buckets.items()
+    }
+
+
+def fetch_events_for_range(
+    ics_urls_with_types, start_date, end_date, feeds=None, tz=None, dates=None
+):
+    """
+    Fetches and processes the events of every day from start_date to
+    end_date (inclusive) with one fetch, one parse and one recurrence
+    expansion per calendar, for callers like weekly reviews or dashboards.
+    Pass `dates` to only look up some days of the range (e.g. the days
+    that have a note), and the result of fetch_calendar_feeds() as
+    `feeds` to reuse already downloaded calendars. Days are counted in tz
+    (default: CALENDAR_TIMEZONE).
+    Returns a dict mapping each date, in order, to a list of CalendarEvents.
+    """
+    if end_date < start_date:
+        raise ValueError(f"end_date {end_date} is before start_date {start_date}")
+
+    if dates is None:
+        dates = note_days(start_date, end_date)
+    else:
+        dates = sorted(day for day in set(dates) if start_date <= day <= end_date)
+
+    logger.info(f"Fetching events from {start_date} to {end_date}")
+    if feeds is None:
+        feeds = fetch_calendar_feeds(ics_urls_with_types)
+
+    event_index = build_event_index(ics_urls_with_types, dates, feeds, tz)
+    events_found = sum(len(events) for events in event_index.values())
+    logger.info(f"Found {events_found} events on {len(event_index)} day(s)")
+    return event_index
+
+
+def fetch_events_for_date(ics_urls_with_types, target_date, feeds=None, tz=None):
+    """
+    Fetches and processes events, properly handling recurring events.
+    Pass the result of fetch_calendar_feeds() as `feeds` to reuse
+    already downloaded calendars instead of fetching them again.
+    Returns a list of CalendarEvents.
+    """
+    logger.info(f"Fetching events for date: {target_date}")
+    event_index = fetch_events_for_range(
+        ics_urls_with_types, target_date, target_date, feeds=feeds, tz=tz
+    )
+    events_for_date = event_index[target_date]
+
+    logger.info(f"Found {len(events_for_date)} events for {target_date}")
+    return events_for_date
+
+
+# -------------------------------------------------------------------
+# 2. NOTE UPDATING
+# -------------------------------------------------------------------
+
+
+@lru_cache(maxsize=4096)
+def pick_event_emoji(summary):
+    """
+    Returns the emoji of the first EVENT_KEYWORDS entry (in dict order)
+    that appears anywhere in the summary, or the default calendar emoji.
+    Memoized, since recurring events repeat the same titles.
+    """
+    keywords = (
+        match.group(1) for match in EVENT_KEYWORD_PATTERN.finditer(summary.lower())
+    )
+    keyword = min(keywords, key=EVENT_KEYWORD_RANKS.__getitem__, default=None)
+    return EVENT_KEYWORDS[keyword] if keyword else "📅"
+
+
+class RenderCache:
+    """
+    LRU cache of rendered events without their time prefix. Entries are
+    keyed by the event's identity (see render_key()), so every occurrence
+    of a recurring event and every note it shows up in shares one entry.
+    Safe to share between the threads of a note pool.
+    """
+
+    __slots__ = ("maxsize", "hits", "misses", "_entries", "_lock")
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        """Returns the cached value for key, calling render() on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        value = render()
+        with self._lock:
+            self._entries[key] = value
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def reset_stats(self):
+        """Zeroes the hit and miss counts, e.g. at the start of a run."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+
+def render_key(evt):
+    """
+    Returns the render cache key of a CalendarEvent: its UID, override
+    (RECURRENCE-ID), SEQUENCE and LAST-MODIFIED identify one version of
+    the event. Events missing a UID or LAST-MODIFIED are keyed by the
+    fields that get rendered instead, so edits to them aren't missed.
+    """
+    key = (
+        evt.calendar_type,
+        evt.all_day,
+        evt.uid,
+        evt.recurrence_id,
+        evt.sequence,
+        evt.last_modified,
+    )
+    if not evt.uid or not evt.last_modified:
+        key += (evt.summary, evt.url, evt.location, evt.meeting_link)
+    return key
+
+
+def render_event_details(evt):
+    """
+    Renders the part of an event's markdown line that's the same for all
+    of its occurrences: the event link, emoji, calendar label and the
+    indented meeting link and location.
+    """
+    event_name = evt.summary
+    calendar_name = CALENDAR_LABELS.get(evt.calendar_type, "(Other 🤷)")
+
+    # Construct the main event link (URL or fallback search link)
+    if evt.url:
+        event_text = f"[{event_name}]({evt.url})"
+    else:
+        search_query = event_name.replace(" ", "+")
+        google_cal_link = (
+            f"https://calendar.google.com/calendar/u/0/r/search?q={search_query}"
+        )
+        event_text = f"[{event_name}]({google_cal_link})"
+
+    if evt.all_day:
+        # Pick an emoji based on event keywords
+        event_emoji = pick_event_emoji(event_name)
+        details = f"📅 {event_text} {event_emoji} `{calendar_name}`\n"
+    else:
+        details = f"{event_text} `{calendar_name}`\n"
+
+    # Indent meeting link and location details
+    if evt.meeting_link:
+        details += f"    - 🔗 [Join meeting]({evt.meeting_link})\n"
+    if evt.location:
+        maps_query = evt.location.replace(" ", "+")
+        maps_link = f"https://www.google.com/maps/search/?api=1&query={maps_query}"
+        details += f"    - 📍 [{evt.location}]({maps_link})\n"
+
+    return details.rstrip()
+
+
+def format_events_as_markdown(events):
+    """
+    Takes a list of CalendarEvents and returns a markdown string without
+    appending any timezone abbreviations.
+    """
+    if not events:
+        return "_No events today_\n"
+
+    lines = []
+
+    for evt in events:
+        details = render_cache.get(render_key(evt), lambda: render_event_details(evt))
+
+        # Final line
+        if evt.all_day:
+            line = f"- {details}"
+        else:
+            start_time_str = evt.start.strftime("%H:%M")
+            end_time_str = evt.end.strftime("%H:%M")
+            line = f"- **{start_time_str} - {end_time_str}** {details}"
+
+        lines.append(line)
+
+    return "\n".join(lines) + "\n"
+
+
+def format_week_events_as_markdown(events_by_day):
+    """
+    Takes a dict mapping each day of a week note to its CalendarEvents and
+    returns a markdown string with a bold line per day that has events,
+    followed by that day's events (see format_events_as_markdown()).
+    """
+    lines = []
+    for day, events in events_by_day.items():
+        if events:
+            lines.append(f"**{day.strftime('%a %m-%d')}**\n")
+            lines.append(format_events_as_markdown(events))
+
+    if not lines:
+        return "_No events this week_\n"
+    return "".join(lines)
+
+
+def splice_calendar_section(
+    content, events_md, header=HEADER_CALENDAR_EVENTS, generated_only=False
+):
+    """
+    Removes all calendar sections from the content, regardless of slight
+    header variations, and inserts the new one (header followed by
+    events_md) after a known table (if present) but before the rest of
+    the note, in a single pass over its lines. With generated_only, only
+    sections under the exact HEADER_CALENDAR_EVENTS header this script
+    writes are removed. The note's own line endings are kept; the new
+    section uses the ending of the note's first line.
+    Returns (updated_content, number_of_sections_removed)
+    """
+    generated_header = HEADER_CALENDAR_EVENTS.strip()
+    kept = []
+    table_end_idx = -1
+    in_calendar_section = False
+    sections_removed = 0
+    newline = None
+
+    for line in content.splitlines(keepends=True):
+        text = line.rstrip("\r\n")
+        if newline is None and len(text) < len(line):
+            newline = line[len(text) :]  # noqa: E203
+        stripped = text.strip()
+
+        # Markers of a calendar block (see splice_calendar_block()) go too
+        if stripped in (CALENDAR_BLOCK_START, CALENDAR_BLOCK_END):
+            continue
+
+        # Check for any variation of calendar headers
+        if generated_only:
+            is_calendar_header = stripped == generated_header
+        else:
+            is_calendar_header = (
+                stripped.startswith("#") and "calendar" in stripped.lower()
+            )
+        if is_calendar_header:
+            in_calendar_section = True
+            sections_removed += 1
+            continue
+
+        if in_calendar_section:
+            if not stripped.startswith("#"):
+                continue
+            in_calendar_section = False  # Keep that header
+
+        if "|" in text and "[[" in text and "]]" in text:
+            table_end_idx = len(kept)
+        kept.append(line)
+
+    newline = newline or "\n"
+    if newline != "\n":
+        header = header.replace("\n", newline)
+        events_md = events_md.replace("\n", newline)
+
+    # The last line of the note never gets a line ending of its own
+    if kept:
+        kept[-1] = kept[-1].rstrip("\r\n")
+
+    if table_end_idx == -1:
+        pieces = [header, newline, events_md]
+        pieces += kept
+        return "".join(pieces), sections_removed
+
+    # A note ending in a blank line keeps one line break less after the
+    # table, as before
+    if not kept[-1]:
+        kept.pop()
+        kept[-1] = kept[-1].rstrip("\r\n")
+
+    table_end = kept[table_end_idx]
+    table_end_text = table_end.rstrip("\r\n")
+    pieces = kept[:table_end_idx]
+    pieces += [
+        table_end_text,
+        table_end[len(table_end_text) :] or newline,  # noqa: E203
+        newline,
+        header,
+        events_md,
+        newline,
+    ]
+    pieces += kept[table_end_idx + 1 :]  # noqa: E203
+    return "".join(pieces), sections_removed
+
+
+def find_calendar_block(content):
+    """
+    Returns the (start, end) offsets of the text between the last pair of
+    calendar block markers in a note, or None if it has no complete block.
+    """
+    end = content.find(CALENDAR_BLOCK_END)
+    if end == -1:
+        return None
+    start = content.rfind(CALENDAR_BLOCK_START, 0, end)
+    if start == -1:
+        return None
+    return start + len(CALENDAR_BLOCK_START), end
+
+
+def read_calendar_block(content):
+    """
+    Returns the events markdown inside a note's calendar block, with LF
+    line endings, or None if the note has no (intact) block. Comparing its
+    hash with the manifest tells whether the note needs an update without
+    rendering anything.
+    """
+    block = find_calendar_block(content)
+    if block is None:
+        return None
+    section = content[block[0] : block[1]].replace("\r\n", "\n")  # noqa: E203
+    prefix = "\n" + HEADER_CALENDAR_EVENTS
+    return section[len(prefix) :] if section.startswith(prefix) else None  # noqa: E203
+
+
+def splice_calendar_block(content, events_md):
+    """
+    Marker mode: replaces the text between the calendar block markers,
+    leaving everything else in the note alone, even headers that mention a
+    calendar. Notes without a block yet get the sections this script
+    generated before (exact '### Calendar Events' header) removed once and
+    a marked block inserted where they used to go. Either way the block is
+    laid out the same, so splicing the same events again is a no-op.
+    Returns (updated_content, number_of_sections_removed)
+    """
+    section = "\n" + HEADER_CALENDAR_EVENTS + events_md
+
+    block = find_calendar_block(content)
+    if block is None:
+        # The whole block goes in as the "header", so none of the spacing
+        # splice_calendar_section() puts between header and events applies
+        return splice_calendar_section(
+            content,
+            "",
+            header=CALENDAR_BLOCK_START + section + CALENDAR_BLOCK_END + "\n",
+            generated_only=True,
+        )
+
+    start, end = block
+    line_end = content.find("\n")
+    if line_end > 0 and content[line_end - 1] == "\r":
+        section = section.replace("\n", "\r\n")
+
+    if content[start:end] == section:
+        return content, 0
+    return "".join([content[:start], section, content[end:]]), 0
+
+
+def update_note(file_path, events, markers=False):
+    """
+    Load the file, remove all calendar sections, then add the new one at
+    the top. With markers, only the marked calendar block is replaced (see
+    splice_calendar_block()). events is a list of CalendarEvents, or for
+    week notes a dict mapping each day to its list. The file is only
+    rewritten if its content actually changed.
+    Returns (written, events_md) where written is False if the note was
+    left untouched.
+    """
+    logger.info(f"Updating note: {file_path}")
+    if os.path.exists(file_path):
+        logger.info("File exists, reading content...")
+        with open(file_path, "r", encoding="utf-8", newline="") as f:
+            content = f.read()
+    else:
+        logger.info("File doesn't exist, starting with blank content")
+        content = None
+
+    if isinstance(events, dict):
+        events_md = format_week_events_as_markdown(events)
+        events_found = sum(len(day_events) for day_events in events.values())
+    else:
+        events_md = format_events_as_markdown(events)
+        events_found = len(events)
+    splice = splice_calendar_block if markers else splice_calendar_section
+    updated_content, sections_removed = splice(content or "", events_md)
+    if sections_removed > 0:
+        logger.info(f"Removed {sections_removed} calendar section(s)")
+
+    if updated_content == content:
+        logger.info("Calendar section unchanged, skipping write")
+        return False, events_md
+
+    logger.info(f"Writing updated content with {events_found} events")
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        f.write(updated_content)
+    return True, events_md
+
+
+def update_note_counted(file_path, events, markers=False):
+    """
+    update_note() as run on the note pool. Also returns the (hits, misses)
+    the call added to render_cache, since a process worker's cache is its
+    own and the parent never sees its counts.
+    """
+    hits, misses = render_cache.hits, render_cache.misses
+    written, events_md = update_note(file_path, events, markers)
+    return written, events_md, (render_cache.hits - hits, render_cache.misses - misses)
+
+
+def render_cache_stats(executor, worker_stats):
+    """
+    Returns the (hits, misses) of a run's render cache: the sum of what
+    process workers reported, or render_cache's own counts when notes were
+    rendered in this process (where per-call counts overlap between threads).
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        return tuple(map(sum, zip((0, 0), *worker_stats)))
+    return render_cache.hits, render_cache.misses
+
+
+def script_fingerprint():
+    """
+    Returns a hash of this script's source. It is stored in the sync
+    manifest so any change to the rendering code invalidates old entries.
+    """
+    try:
+        with open(__file__, "rb") as f:
+            return hash_text(f.read())
+    except OSError:
+        return None
+
+
+def load_sync_manifest(tz, markers=False):
+    """
+    Loads the per-note sync manifest written by the previous run.
+    Returns an empty manifest if there is none or it was written by a
+    different version of this script or with different settings.
+    """
+    fingerprint = script_fingerprint()
+    settings = {"timezone": str(tz), "markers": markers}
+    empty_manifest = {"script": fingerprint, **settings, "notes": {}}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty_manifest
+
+    if manifest.get("script") != fingerprint or fingerprint is None:
+        logger.info("Sync manifest is from a different script version, ignoring it")
+        return empty_manifest
+    if any(manifest.get(key) != value for key, value in settings.items()):
+        logger.info("Sync manifest is for different settings, ignoring it")
+        return empty_manifest
+    return manifest
+
+
+def save_json_atomically(path, data):
+    """
+    Writes data as JSON to a temporary file and moves it over path, so a
+    crash can't leave a half-written file behind. Raises OSError.
+    """
+    temp_path = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def save_sync_manifest(manifest):
+    """Writes the sync manifest atomically so a crash can't corrupt it."""
+    try:
+        save_json_atomically(MANIFEST_PATH, manifest)
+    except OSError as e:
+        logger.warning(f"Could not save sync manifest.\n{e}")
+
+
+def hash_file(file_path):
+    """Returns hash_text() of a file's bytes, or None if it can't be read."""
+    try:
+        with open(file_path, "rb") as f:
+            return hash_text(f.read())
+    except OSError:
+        return None
+
+
+def note_file_state(file_path):
+    """
+    Returns [mtime_ns, size, content_hash] for a note, or None if it
+    doesn't exist (see is_note_unchanged()).
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, hash_file(file_path)]
+
+
+def is_note_unchanged(entry, file_path):
+    """
+    Returns True if a note is the same as when its manifest entry was
+    recorded. Matching mtime and size settle it without reading the note;
+    otherwise (e.g. after a fresh git checkout, which resets every mtime)
+    notes of the same size are compared by content hash, and a match
+    refreshes the entry's mtime so the next check is a stat again.
+    """
+    saved = entry.get("note")
+    if not saved or len(saved) != 3:
+        return False
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+
+    if [stat.st_mtime_ns, stat.st_size] == saved[:2]:
+        return True
+    if stat.st_size != saved[1] or hash_file(file_path) != saved[2]:
+        return False
+    saved[0] = stat.st_mtime_ns
+    return True
+
+
+def is_note_synced(manifest, file_path, feed_hashes=None, day_fingerprints=None):
+    """
+    Returns True if the note hasn't changed on disk since it was last
+    synced and either every feed (feed_hashes) or at least the events of
+    the note's own day (day_fingerprints) are the same as back then.
+    """
+    entry = manifest["notes"].get(os.path.abspath(file_path))
+    if not entry or not is_note_unchanged(entry, file_path):
+        return False
+    if feed_hashes is not None and entry["feeds"] == feed_hashes:
+        return True
+    return day_fingerprints is not None and entry.get("days") == day_fingerprints
+
+
+def is_calendar_block_synced(manifest, file_path, day_fingerprints):
+    """
+    Marker mode: returns True if the note's day is unchanged and its
+    calendar block still holds the section it was last synced with, even
+    if the rest of the note was edited since. Only the block is hashed.
+    """
+    entry = manifest["notes"].get(os.path.abspath(file_path))
+    if not entry or entry.get("days") != day_fingerprints:
+        return False
+    try:
+        with open(file_path, "r", encoding="utf-8", newline="") as f:
+            events_md = read_calendar_block(f.read())
+    except OSError:
+        return False
+    return events_md is not None and hash_text(events_md) == entry["section"]
+
+
+def record_note_sync(
+    manifest, file_path, feed_hashes, day_fingerprints, events_md=None
+):
+    """
+    Stores what a note was synced against in the manifest. Leave events_md
+    out to keep the section hash of a note that wasn't re-rendered.
+    """
+    key = os.path.abspath(file_path)
+    if events_md is None:
+        section_hash = manifest["notes"][key]["section"]
+    else:
+        section_hash = hash_text(events_md)
+
+    manifest["notes"][key] = {
+        "feeds": feed_hashes,
+        "days": day_fingerprints,
+        "section": section_hash,
+        "note": note_file_state(file_path),
+    }
+
+
+# -------------------------------------------------------------------
+# 3. MAIN LOGIC
+# -------------------------------------------------------------------
+
+
+def load_note_index():
+    """
+    Loads the directory indexes written by previous discoveries (see
+    discover_notes()), keyed by the absolute path of the directory they
+    started from. Returns no indexes if there are none or they were
+    written by a different version of this script.
+    """
+    try:
+        with open(NOTE_INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get("script") != script_fingerprint():
+        return {}
+    return index.get("roots", {})
+
+
+def save_note_index(roots):
+    """Writes the directory indexes for the next discovery."""
+    try:
+        save_json_atomically(
+            NOTE_INDEX_PATH, {"script": script_fingerprint(), "roots": roots}
+        )
+    except OSError as e:
+        logger.warning(f"Could not save note index.\n{e}")
+
+
+def scan_note_directory(path, mtime_ns, formats, previous=None):
+    """
+    Lists one vault directory with os.scandir(), reading note dates in the
+    given formats (see extract_date_from_filename()).
+    Returns its note index entry: the directory's mtime, a hash of its
+    listing, the dates parsed from each markdown file name ('YYYY-MM-DD',
+    'YYYY-MM-DD/YYYY-MM-DD' for week notes, or None if there are none)
+    and the names of its subdirectories, or None if it can't be
+    listed. If the listing hashes the same as the previous entry (e.g. a
+    fresh git checkout only reset the mtime), its dates are reused.
+    """
+    filenames = []
+    dirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # Like os.walk(), don't descend into symlinked directories
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                elif entry.name.lower().endswith(".md"):
+                    filenames.append(entry.name)
+    except OSError as e:
+        logger.warning(f"Could not scan directory: {path}\n{e}")
+        return None
+
+    listing = hash_text("/".join(sorted(filenames)) + "//" + "/".join(sorted(dirs)))
+    if previous is not None and previous.get("listing") == listing:
+        return {**previous, "mtime_ns": mtime_ns}
+
+    notes = {}
+    for filename in filenames:
+        note_dates = extract_note_dates(filename, formats)
+        if note_dates is None:
+            notes[filename] = None
+        elif note_dates[0] == note_dates[1]:
+            notes[filename] = note_dates[0].isoformat()
+        else:
+            notes[filename] = "/".join(day.isoformat() for day in note_dates)
+    return {"mtime_ns": mtime_ns, "listing": listing, "notes": notes, "dirs": dirs}
+
+
+def discover_notes(todo_dir, date_from=None, date_to=None, formats=None):
+    """
+    Finds all dated markdown notes in todo_dir, excluding any directory
+    named in SKIP_DIRS (e.g. '/Archive/' or '/Weekly/') and notes that
+    don't overlap the optional [date_from, date_to] window. File names are
+    read with formats (default: NOTE_DATE_FORMATS).
+    Directories whose mtime didn't change since the last run are taken
+    from the note index instead of being listed again, so an unchanged
+    vault costs one stat per directory; directories whose mtime changed
+    but whose listing didn't (a fresh checkout) skip re-reading dates.
+    Returns a list of (file_path, file_date, last_date) tuples, where
+    last_date is file_date for daily notes and Sunday for week notes.
+    """
+    if formats is None:
+        formats = parse_date_formats(NOTE_DATE_FORMATS)
+
+    # Cached dates are only valid for the formats they were read with
+    notes = []
+    roots = load_note_index()
+    old_root = roots.get(os.path.abspath(todo_dir), {})
+    old_index = (
+        old_root.get("dirs", {}) if old_root.get("formats") == list(formats) else {}
+    )
+    new_index = {}
+    now_ns = time.time_ns()
+
+    pending = [todo_dir]
+    while pending:
+        root = pending.pop()
+        try:
+            mtime_ns = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+
+        key = os.path.abspath(root)
+        entry = old_index.get(key)
+        if entry is None or entry["mtime_ns"] != mtime_ns:
+            entry = scan_note_directory(root, mtime_ns, formats, entry)
+            if entry is None:
+                continue
+        if now_ns - mtime_ns > NOTE_INDEX_RACY_NS:
+            new_index[key] = entry
+
+        # Prune skipped directories instead of walking into them
+        for dirname in reversed(entry["dirs"]):
+            if dirname in SKIP_DIRS:
+                logger.info(f"Skipping directory: {os.path.join(root, dirname)}")
+            else:
+                pending.append(os.path.join(root, dirname))
+
+        for filename, date_value in entry["notes"].items():
+            if not date_value:
+                logger.info(f"Skipping file (no date found): {filename}")
+                continue
+
+            first_value, _, last_value = date_value.partition("/")
+            file_date = datetime.date.fromisoformat(first_value)
+            last_date = datetime.date.fromisoformat(last_value or first_value)
+            if (date_from and last_date < date_from) or (
+                date_to and file_date > date_to
+            ):
+                continue
+
+            notes.append((os.path.join(root, filename), file_date, last_date))
+
+    roots[os.path.abspath(todo_dir)] = {"formats": list(formats), "dirs": new_index}
+    save_note_index(roots)
+    return notes
+
+
+def create_note_pool(workers, pool):
+    """
+    Returns the executor notes are rendered and written on: a pool of
+    `workers` threads or processes, or None to do it inline when there's
+    only one worker.
+    """
+    if workers <= 1:
+        return None
+    if pool == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def run_bounded(executor, func, jobs, max_pending):
+    """
+    Calls func(*job) for every job on the executor, keeping at most
+    max_pending calls queued or running at once, so a huge vault never
+    has all of its notes in flight and results are consumed while later
+    jobs run. Runs inline if executor is None.
+    Yields (job, result) pairs in completion order.
+    """
+    if executor is None:
+        for job in jobs:
+            yield job, func(*job)
+        return
+
+    jobs = iter(jobs)
+    pending = {}
+    while True:
+        for job in jobs:
+            pending[executor.submit(func, *job)] = job
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+
+async def run_bounded_async(executor, func, jobs, max_pending):
+    """
+    Async run_bounded(): calls func(*job) for every job on the executor
+    (the loop's default thread pool if None), keeping at most max_pending
+    calls in flight at once.
+    Yields (job, result) pairs in completion order.
+    """
+    loop = asyncio.get_running_loop()
+    jobs = iter(jobs)
+    pending = {}
+    while True:
+        for job in jobs:
+            pending[loop.run_in_executor(executor, func, *job)] = job
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future.result()
+
+
+def select_pending_notes(manifest, notes, feed_hashes):
+    """
+    Returns the notes that need their events looked up: notes untouched
+    since a sync against identical feeds are already up to date, so they
+    don't need to be parsed, rendered or even read.
+    """
+    pending_notes = [
+        note
+        for note in notes
+        if not is_note_synced(manifest, note[0], feed_hashes=feed_hashes)
+    ]
+    files_skipped = len(notes) - len(pending_notes)
+    if files_skipped:
+        logger.info(f"Skipping {files_skipped} note(s) already in sync")
+    return pending_notes
+
+
+def fetch_events_for_notes(ics_urls_with_types, notes, feeds, tz):
+    """
+    Looks up the events of every day covered by one of the given
+    (file_path, file_date, last_date) notes with a single
+    fetch_events_for_range().
+    """
+    note_dates = {
+        day
+        for _, file_date, last_date in notes
+        for day in note_days(file_date, last_date)
+    }
+    if not note_dates:
+        return {}
+    return fetch_events_for_range(
+        ics_urls_with_types,
+        min(note_dates),
+        max(note_dates),
+        feeds=feeds,
+        tz=tz,
+        dates=note_dates,
+    )
+
+
+def plan_note_updates(manifest, pending_notes, event_index, feed_hashes, markers):
+    """
+    Looks each pending note's days up in the event index and records the
+    notes whose days didn't change as synced.
+    Returns (note_jobs, note_fingerprints, files_unchanged): update_note()
+    arguments for every note that has to be rendered, the day fingerprints
+    to record them with, and how many notes were already in sync.
+    """
+    files_unchanged = 0
+    day_fingerprints = {}
+    note_fingerprints = {}
+    note_jobs = []
+    for file_path, file_date, last_date in pending_notes:
+        days = note_days(file_date, last_date)
+        for day in days:
+            if day not in day_fingerprints:
+                day_fingerprints[day] = fingerprint_day_events(event_index[day])
+
+        # Week notes are rendered and fingerprinted day by day
+        if len(days) == 1:
+            fingerprints = day_fingerprints[file_date]
+            events = event_index[file_date]
+        else:
+            fingerprints = {day.isoformat(): day_fingerprints[day] for day in days}
+            events = {day: event_index[day] for day in days}
+
+        # A changed feed usually only touches a few days; notes whose own
+        # days are unchanged don't need to be re-rendered. In marker mode
+        # that holds even if the note was edited, as long as its block wasn't
+        day_synced = is_note_synced(manifest, file_path, day_fingerprints=fingerprints)
+        if not day_synced and markers:
+            day_synced = is_calendar_block_synced(manifest, file_path, fingerprints)
+        if day_synced:
+            record_note_sync(manifest, file_path, feed_hashes, fingerprints)
+            files_unchanged += 1
+            continue
+
+        note_fingerprints[file_path] = fingerprints
+        note_jobs.append((file_path, events, markers))
+
+    return note_jobs, note_fingerprints, files_unchanged
+
+
+@lru_cache(maxsize=65536)
+def extract_note_dates(filename, formats=None):
+    """
+    Attempt to parse the days a note covers from filenames like
+    '12-21-2024 (Sat) 📝.md' or '2024-W51.md', trying each of the
+    NOTE_DATE_PATTERNS formats in order (default: NOTE_DATE_FORMATS).
+    Return (first_date, last_date), the same date for daily notes and
+    Monday to Sunday for ISO week notes, or None if not parseable.
+    """
+    if formats is None:
+        formats = parse_date_formats(NOTE_DATE_FORMATS)
+
+    for date_format in formats:
+        match = NOTE_DATE_PATTERNS[date_format].search(filename)
+        if not match:
+            continue
+        parts = match.groupdict()
+        try:
+            if "week" in parts:
+                monday = datetime.date.fromisocalendar(
+                    int(parts["year"]), int(parts["week"]), 1
+                )
+                return monday, monday + timedelta(days=6)
+            file_date = datetime.date(
+                int(parts["year"]), int(parts["month"]), int(parts["day"])
+            )
+            return file_date, file_date
+        except ValueError:
+            continue
+    return None
+
+
+def extract_date_from_filename(filename, formats=None):
+    """
+    Attempt to parse a date from filenames like '12-21-2024 (Sat) 📝.md'
+    (see extract_note_dates()). Week notes are dated by their Monday.
+    Return a datetime.date object or None if not parseable.
+    """
+    note_dates = extract_note_dates(filename, formats)
+    return note_dates[0] if note_dates else None
+
+
+def note_days(first_date, last_date):
+    """Returns every date from first_date to last_date (inclusive)."""
+    days = (last_date - first_date).days
+    return [first_date + timedelta(days=offset) for offset in range(days + 1)]
+
+
+def parse_date_formats(value):
+    """
+    Parses a comma-separated list of NOTE_DATE_PATTERNS names, like
+    'yyyy-mm-dd,yyyy-Www', into a tuple.
+    Raises argparse.ArgumentTypeError if a name is unknown.
+    """
+    formats = tuple(name.strip() for name in value.split(",") if name.strip())
+    unknown = [name for name in formats if name not in NOTE_DATE_PATTERNS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"invalid date formats '{value}', expected a comma-separated list "
+            f"of {', '.join(NOTE_DATE_PATTERNS)}"
+        )
+    return formats
+
+
+def parse_timezone(value):
+    """
+    Resolves a timezone name like 'Europe/Berlin' to a ZoneInfo.
+    Raises argparse.ArgumentTypeError if the name is unknown.
+    """
+    tz = get_timezone(value.strip())
+    if tz is None:
+        raise argparse.ArgumentTypeError(
+            f"unknown timezone '{value}', expected e.g. America/New_York"
+        )
+    return tz
+
+
+def parse_date_bound(value, today=None):
+    """
+    Parses one end of the sync window: either an offset from today like
+    '-7d', '+30d' or '+2w', or an absolute 'YYYY-MM-DD' date.
+    Returns a datetime.date, or None for an empty value (unbounded).
+    """
+    if not value:
+        return None
+
+    match = re.fullmatch(r"([+-]?\d+)([dw])", value.strip().lower())
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        if today is None:
+            today = datetime.datetime.now(parse_timezone(CALENDAR_TIMEZONE)).date()
+        days = amount * 7 if unit == "w" else amount
+        return today + timedelta(days=days)
+
+    try:
+        return datetime.date.fromisoformat(value.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid date '{value}', expected e.g. -7d, +30d, +2w or 2024-12-21"
+        )
+
+
+def parse_workers(value):
+    """Parses the number of note workers: a positive integer."""
+    try:
+        workers = int(value)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        raise argparse.ArgumentTypeError(f"invalid worker count '{value}'")
+    return workers
+
+
+def parse_args(argv=None):
+    """
+    Parses command line options. Each option falls back to an environment
+    variable so the GitHub Action can configure runs without changing the
+    command.
+    """
+    parser = argparse.ArgumentParser(
+        description="Sync Google Calendar events into Obsidian daily notes."
+    )
+    parser.add_argument(
+        "--timezone",
+        type=parse_timezone,
+        default=CALENDAR_TIMEZONE,
+        help="IANA timezone events are shown in and offsets like -7d are "
+        "counted from (default: America/New_York). Env: CALENDAR_TIMEZONE",
+    )
+    parser.add_argument(
+        "--markers",
+        action="store_true",
+        default=os.getenv("CALENDAR_SYNC_MARKERS", "").lower() in ("1", "true", "yes"),
+        help="Wrap the calendar section in <!-- gcal:start/end --> comments and "
+        "only ever replace what's between them. Env: CALENDAR_SYNC_MARKERS=1",
+    )
+    parser.add_argument(
+        "--date-formats",
+        type=parse_date_formats,
+        default=NOTE_DATE_FORMATS,
+        help="Comma-separated file name date formats to read note dates with, "
+        f"tried in order: {', '.join(NOTE_DATE_PATTERNS)} (default: mm-dd-yyyy). "
+        "yyyy-Www notes get their whole ISO week. Env: CALENDAR_NOTE_DATE_FORMATS",
+    )
+    parser.add_argument(
+        "--workers",
+        type=parse_workers,
+        default=os.getenv("CALENDAR_SYNC_WORKERS", str(os.cpu_count() or 1)),
+        help="How many notes to render and write at once (default: one per "
+        "CPU; 1 disables the pool). Env: CALENDAR_SYNC_WORKERS",
+    )
+    parser.add_argument(
+        "--pool",
+        choices=("thread", "process"),
+        default=os.getenv("CALENDAR_SYNC_POOL", "thread"),
+        help="Render and write notes on a pool of threads (default) or "
+        "processes. Env: CALENDAR_SYNC_POOL",
+    )
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        default=os.getenv("CALENDAR_SYNC_FROM"),
+        help="Only sync notes dated on/after this (e.g. -7d or 2024-12-01). "
+        "Env: CALENDAR_SYNC_FROM",
+    )
+    parser.add_argument(
+        "--to",
+        dest="date_to",
+        default=os.getenv("CALENDAR_SYNC_TO"),
+        help="Only sync notes dated on/before this (e.g. +30d or 2025-01-31). "
+        "Env: CALENDAR_SYNC_TO",
+    )
+
+    # argparse reads a negative offset like '-7d' as an unknown option, so
+    # glue it to its flag ('--from=-7d') before parsing
+    args = []
+    for arg in sys.argv[1:] if argv is None else argv:
+        if args and args[-1] in ("--from", "--to") and re.fullmatch(r"-\d+[dw]", arg):
+            args[-1] = f"{args[-1]}={arg}"
+        else:
+            args.append(arg)
+    args = parser.parse_args(args)
+
+    # Offsets are relative to today in the configured timezone, which is
+    # only known once every option has been parsed
+    today = datetime.datetime.now(args.timezone).date()
+    try:
+        args.date_from = parse_date_bound(args.date_from, today)
+        args.date_to = parse_date_bound(args.date_to, today)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    return args
+
+
+def main(argv=None):
+    """
+    Runs the sync as a staged pipeline:
+    1. Discover all dated notes in a specified directory (e.g. ./TODO/),
+       skipping notes outside the optional --from/--to window.
+    2. Fetch every ICS feed once, expand its events for all note dates in
+       a single pass per calendar and look each note's day up, skipping
+       notes that are already in sync.
+    3. Render and splice the calendar section of the remaining notes and
+    4. write them back, both on a bounded pool of --workers.
+    """
+    args = parse_args(argv)
+    logger.info("Starting calendar update script...")
+    render_cache.reset_stats()
+
+    # Define calendar URLs with their types (replace with your own environment variables or strings)
+    calendar_configs = [
+        (os.getenv("GOOGLE_CALENDAR_PERSONAL"), "personal"),
+        (os.getenv("GOOGLE_CALENDAR_EVENTS"), "events"),
+        (os.getenv("GOOGLE_CALENDAR_HOLIDAYS_US"), "us_holidays"),
+    ]
+    ics_urls_with_types = [(url, cal_type) for url, cal_type in calendar_configs if url]
+
+    # Stage 1: discover notes
+    todo_dir = "TODO"
+    logger.info(f"Scanning directory: {todo_dir}")
+    if args.date_from or args.date_to:
+        logger.info(
+            f"Only syncing notes from {args.date_from or 'the beginning'} "
+            f"to {args.date_to or 'the end'}"
+        )
+
+    notes = discover_notes(todo_dir, args.date_from, args.date_to, args.date_formats)
+    if not notes:
+        logger.info("No notes to update")
+        return
+
+    # Stage 2: look up each note's events in the shared index
+    feeds = fetch_calendar_feeds(ics_urls_with_types)
+    feed_hashes = {hash_text(ics_url): digest for ics_url, digest in feeds.items()}
+
+    manifest = load_sync_manifest(args.timezone, args.markers)
+    pending_notes = select_pending_notes(manifest, notes, feed_hashes)
+    event_index = fetch_events_for_notes(
+        ics_urls_with_types, pending_notes, feeds, args.timezone
+    )
+    note_jobs, note_fingerprints, files_unchanged = plan_note_updates(
+        manifest, pending_notes, event_index, feed_hashes, args.markers
+    )
+    files_unchanged += len(notes) - len(pending_notes)
+
+    # Stages 3 and 4: render, splice and write the notes on the pool. The
+    # manifest is only ever touched here, as results come back
+    files_changed = 0
+    worker_stats = []
+    workers = min(args.workers, len(note_jobs))
+    if workers > 1:
+        logger.info(
+            f"Updating {len(note_jobs)} note(s) with {workers} {args.pool} workers"
+        )
+    executor = create_note_pool(workers, args.pool)
+    try:
+        results = run_bounded(
+            executor, update_note_counted, note_jobs, 2 * args.workers
+        )
+        for (file_path, _, _), (written, events_md, stats) in results:
+            worker_stats.append(stats)
+            if written:
+                files_changed += 1
+            else:
+                files_unchanged += 1
+            record_note_sync(
+                manifest,
+                file_path,
+                feed_hashes,
+                note_fingerprints[file_path],
+                events_md,
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    save_sync_manifest(manifest)
+    log_sync_summary(
+        files_changed, files_unchanged, render_cache_stats(executor, worker_stats)
+    )
+
+
+async def sync(
+    ics_urls_with_types,
+    todo_dir="TODO",
+    date_from=None,
+    date_to=None,
+    date_formats=None,
+    tz=None,
+    markers=False,
+    workers=1,
+    pool="thread",
+):
+    """
+    Async version of main() for embedding the sync in a long-running
+    service. Feeds are fetched concurrently (with httpx, if installed),
+    parsing and expansion run in an executor and notes are read and
+    written off the event loop, so the loop is never blocked.
+    Options match main()'s command line and may be given as parsed values
+    or as the same strings (e.g. date_from="-7d", tz="Europe/Berlin",
+    date_formats="yyyy-mm-dd,dd.mm.yyyy"); tz defaults to CALENDAR_TIMEZONE.
+    Returns (files_changed, files_unchanged).
+    Raises argparse.ArgumentTypeError for an invalid option string.
+    """
+    if isinstance(date_from, str):
+        date_from = parse_date_bound(date_from)
+    if isinstance(date_to, str):
+        date_to = parse_date_bound(date_to)
+    if isinstance(date_formats, str):
+        date_formats = parse_date_formats(date_formats)
+    elif date_formats is not None:
+        date_formats = parse_date_formats(",".join(date_formats))
+    if tz is None:
+        tz = CALENDAR_TIMEZONE
+    if isinstance(tz, str):
+        tz = parse_timezone(tz)
+    render_cache.reset_stats()
+
+    notes = await asyncio.to_thread(
+        discover_notes, todo_dir, date_from, date_to, date_formats
+    )
+    if not notes:
+        logger.info("No notes to update")
+        return 0, 0
+
+    feeds = await fetch_calendar_feeds_async(ics_urls_with_types)
+    feed_hashes = {hash_text(ics_url): digest for ics_url, digest in feeds.items()}
+
+    manifest = await asyncio.to_thread(load_sync_manifest, tz, markers)
+    pending_notes = await asyncio.to_thread(
+        select_pending_notes, manifest, notes, feed_hashes
+    )
+
+    loop = asyncio.get_running_loop()
+    executor = create_note_pool(workers, pool)
+    try:
+        event_index = await loop.run_in_executor(
+            executor,
+            fetch_events_for_notes,
+            ics_urls_with_types,
+            pending_notes,
+            feeds,
+            tz,
+        )
+        note_jobs, note_fingerprints, files_unchanged = await asyncio.to_thread(
+            plan_note_updates,
+            manifest,
+            pending_notes,
+            event_index,
+            feed_hashes,
+            markers,
+        )
+        files_unchanged += len(notes) - len(pending_notes)
+
+        files_changed = 0
+        worker_stats = []
+        results = run_bounded_async(
+            executor, update_note_counted, note_jobs, 2 * workers
+        )
+        async for (file_path, _, _), (written, events_md, stats) in results:
+            worker_stats.append(stats)
+            if written:
+                files_changed += 1
+            else:
+                files_unchanged += 1
+            record_note_sync(
+                manifest,
+                file_path,
+                feed_hashes,
+                note_fingerprints[file_path],
+                events_md,
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    await asyncio.to_thread(save_sync_manifest, manifest)
+    log_sync_summary(
+        files_changed, files_unchanged, render_cache_stats(executor, worker_stats)
+    )
+    return files_changed, files_unchanged
+
+
+def log_sync_summary(files_changed, files_unchanged, render_stats=(0, 0)):
+    """Logs the render cache (hits, misses) and how many notes a run changed."""
+    hits, misses = render_stats
+    if hits or misses:
+        logger.info(f"Render cache: {hits} hit(s), {misses} miss(es)")
+    logger.info(
+        f"Finished processing {files_changed + files_unchanged} files "
+        f"({files_changed} changed, {files_unchanged} unchanged)"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import os
+
+import pytest
+
+import main
+
+NOTES = [
+    "",
+    "# Journal calendar ideas\nx\n",
+    "# Day\n\n| a | [[link]] |\n|---|---|\n\n### Calendar Events\nold\n\n## Notes\n",
+    "# T\r\n| x | [[y]] |\r\n### Calendar Events\r\n- old\r\n## Rest\r\nbody\r\n",
+]
+
+EVENTS = ["_No events today_\n", "- **09:00 - 10:00** [Standup](x) `(Personal 🗓️)`\n"]
+
+
+@pytest.mark.parametrize("note", NOTES)
+@pytest.mark.parametrize("events_md", EVENTS)
+def test_splice_calendar_block_is_idempotent(note, events_md):
+    once, _ = main.splice_calendar_block(note, events_md)
+    twice, _ = main.splice_calendar_block(once, events_md)
+    assert twice == once
+    assert main.read_calendar_block(once) == events_md
+
+
+def test_splice_calendar_block_keeps_user_calendar_headers():
+    note, _ = main.splice_calendar_block("# Journal calendar ideas\nx\n", "- a\n")
+    assert "# Journal calendar ideas\nx" in note
+
+
+def test_is_note_synced_survives_mtime_reset(tmp_path):
+    note = tmp_path / "01-02-2025.md"
+    note.write_text("# Day\n")
+    manifest = {"notes": {}}
+    main.record_note_sync(manifest, str(note), {"a": "1"}, None, "- a\n")
+    os.utime(note, ns=(0, 0))
+    assert main.is_note_synced(manifest, str(note), {"a": "1"})
+    note.write_text("# Dax\n")
+    assert not main.is_note_synced(manifest, str(note), {"a": "1"})
+
+
+def test_iter_content_lines_unfolds_split_utf8():
+    raw = "SUMMARY:Café\r\n".encode("utf-8")
+    lines = [raw[:12] + b"\r\n", b" " + raw[12:], b"END:VEVENT\r\n"]
+    assert list(main.iter_content_lines(lines)) == ["SUMMARY:Café", "END:VEVENT"]
+
+
+def test_extract_date_from_filename_defaults_to_configured_formats(monkeypatch):
+    monkeypatch.setattr(main, "NOTE_DATE_FORMATS", "yyyy-mm-dd")
+    main.extract_note_dates.cache_clear()
+    assert main.extract_date_from_filename("2024-12-21.md") == datetime.date(
+        2024, 12, 21
+    )
+    assert main.extract_date_from_filename("12-21-2024.md") is None
+    main.extract_note_dates.cache_clear()
+
+
+@pytest.mark.parametrize("date_formats", ["yyyy-mm-dd", ["yyyy-mm-dd"]])
+def test_sync_accepts_option_strings(tmp_path, monkeypatch, date_formats):
+    monkeypatch.setattr(main, "NOTE_INDEX_PATH", str(tmp_path / "index.json"))
+    monkeypatch.setattr(main, "MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    (tmp_path / "vault").mkdir()
+    (tmp_path / "vault" / "2024-12-21.md").write_text("# Day\n")
+    result = asyncio.run(
+        main.sync(
+            [], str(tmp_path / "vault"), date_formats=date_formats, tz="Europe/Berlin"
+        )
+    )
+    assert result == (1, 0)
+
+
+@pytest.mark.parametrize(
+    "tzid, expected",
+    [
+        ("Eastern Standard Time", "America/New_York"),
+        ("/mozilla.org/20050126_1/Europe/Berlin", "Europe/Berlin"),
+        ("Europe/Paris", "Europe/Paris"),
+    ],
+)
+def test_get_event_timezone_maps_non_iana_tzids(tzid, expected):
+    assert str(main.get_event_timezone(tzid)) == expected
+
+
+def test_get_event_timezone_warns_for_unknown_tzids(caplog):
+    assert main.get_event_timezone("Custom Zone 1") is None
+    assert main.get_event_timezone("Custom Zone 1") is None
+    assert caplog.text.count("Unknown timezone 'Custom Zone 1'") == 1
+
+
+def test_extract_note_dates_spans_iso_weeks():
+    assert main.extract_note_dates("2024-W51.md", ("yyyy-Www",)) == (
+        datetime.date(2024, 12, 16),
+        datetime.date(2024, 12, 22),
+    )
+    assert main.extract_note_dates("12-21-2024.md", ("mm-dd-yyyy",)) == (
+        datetime.date(2024, 12, 21),
+        datetime.date(2024, 12, 21),
+    )
+
+
+def test_format_week_events_as_markdown_skips_empty_days():
+    monday = datetime.date(2024, 12, 16)
+    events_by_day = {monday + datetime.timedelta(days=i): [] for i in range(7)}
+    assert main.format_week_events_as_markdown(events_by_day) == (
+        "_No events this week_\n"
+    )